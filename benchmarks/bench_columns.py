@@ -0,0 +1,81 @@
+"""
+Micro-benchmarks of validate, normalize and clean of every column type
+"""
+from datetime import date
+from timeit import default_timer
+
+from telega_megaimport import columns
+
+from generators import generate_rows
+
+
+def column_cases(with_models=False):
+    """
+    Yields name of case, column and kind of generated values
+    """
+    yield 'StringColumn', columns.StringColumn(), 'string'
+    yield 'IntegerColumn', columns.IntegerColumn(), 'integer'
+    yield 'FloatColumn', columns.FloatColumn(), 'float'
+    yield 'BooleanColumn', columns.BooleanColumn(), 'boolean'
+    yield 'DateTimeColumn', columns.DateTimeColumn(cache_size=0), 'date'
+    yield 'DateTimeColumn(formats)', columns.DateTimeColumn(formats=['%Y-%m-%d'], cache_size=0), 'date'
+    yield 'DateTimeColumn(cache)', columns.DateTimeColumn(), 'date'
+    if with_models:
+        from telega_megaimport.tests.models import BasicModel
+        yield 'ModelColumn', columns.ModelColumn(queryset=BasicModel.objects.all(), lookup_arg='text'), 'string'
+
+
+def benchmark_columns(values=10000, seed=0, with_models=False):
+    """
+    Returns list of results: values per second for every method of column
+    """
+    results = []
+    for name, column, kind in column_cases(with_models):
+        # Values are passed as they are read from .csv file
+        data = [_as_text(row[0]) for row in generate_rows([kind], values, seed)]
+        if with_models and isinstance(column, columns.ModelColumn):
+            _create_objects(column, data)
+        methods = [
+            ('validate', _each(column.validate, data)),
+            ('normalize', _each(column.normalize, data)),
+            ('clean', _each(column.clean, data)),
+        ]
+        if column.clean_batch.__func__ is not columns.BaseColumn.clean_batch.__func__ and _has_numpy():
+            methods.append(('clean_batch', lambda: column.clean_batch(data)))
+        for method_name, run in methods:
+            start = default_timer()
+            run()
+            elapsed = default_timer() - start
+            results.append({
+                'column': name,
+                'method': method_name,
+                'values': len(data),
+                'seconds': elapsed,
+                'values_per_sec': len(data) / elapsed if elapsed else None,
+            })
+    return results
+
+
+def _each(method, data):
+    def run():
+        for value in data:
+            method(value)
+    return run
+
+
+def _as_text(value):
+    return value.isoformat() if isinstance(value, date) else str(value)
+
+
+def _create_objects(column, data):
+    model = column.queryset.model
+    model.objects.all().delete()
+    model.objects.bulk_create([model(text=text) for text in set(data)])
+
+
+def _has_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return False
+    return True
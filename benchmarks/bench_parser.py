@@ -0,0 +1,92 @@
+"""
+End-to-end benchmarks of BaseParser.handle on synthetic files
+"""
+import os
+import resource
+from StringIO import StringIO
+from timeit import default_timer
+
+from django.core.management import call_command
+from django.db import connection
+
+from telega_megaimport import columns
+from telega_megaimport.parser import BaseParser
+from telega_megaimport.profiler import count_queries
+from telega_megaimport.tests.models import BasicModel
+
+from generators import column_titles
+
+PARSER_MODES = ('noop', 'row', 'sink')
+
+COLUMN_FACTORIES = {
+    'string': columns.StringColumn,
+    'integer': columns.IntegerColumn,
+    'float': columns.FloatColumn,
+    'boolean': columns.BooleanColumn,
+    'date': lambda: columns.DateTimeColumn(formats=['%Y-%m-%d']),
+}
+
+
+def _noop_row(self, values):
+    pass
+
+
+def _create_row(self, values):
+    BasicModel.objects.create(text='benchmark')
+
+
+def _sink_row(self, values):
+    return {'text': 'benchmark'}
+
+
+def make_parser(kinds, mode):
+    """
+    Parser with columns of given kinds; noop mode only parses rows,
+    row mode creates object per row and sink mode inserts them in bulk
+    """
+    attrs = dict((title, COLUMN_FACTORIES[kind]()) for title, kind in zip(column_titles(kinds), kinds))
+    if mode == 'row':
+        attrs['row'] = _create_row
+    elif mode == 'sink':
+        attrs['sink'] = _sink_row
+        attrs['sink_model'] = BasicModel
+    elif mode == 'noop':
+        attrs['row'] = _noop_row
+    else:
+        raise ValueError('Unknown parser mode: {}'.format(mode))
+    return type('BenchmarkParser', (BaseParser,), attrs)()
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_parser_benchmark(path, kinds, mode, rows, options=None):
+    """
+    Parse file with BaseParser.handle; returns rows per second,
+    queries per row (savepoints included) and peak memory of process
+    """
+    options = options or {}
+    parser = make_parser(kinds, mode)
+    start_rss = max_rss_kb()
+    with count_queries(connection) as counter:
+        start = default_timer()
+        call_command(parser, path, stdout=StringIO(), verbosity=0, **options)
+        elapsed = default_timer() - start
+    if mode != 'noop':
+        BasicModel.objects.all().delete()
+    return {
+        'format': os.path.splitext(path)[1][1:],
+        'mode': mode,
+        'rows': rows,
+        'columns': len(kinds),
+        'options': options,
+        'parsed_successfully': parser.parsed_successfully,
+        'parsed_unsuccessfully': parser.parsed_unsuccessfully,
+        'seconds': elapsed,
+        'rows_per_sec': rows / elapsed if elapsed else None,
+        'queries': counter['queries'],
+        'queries_per_row': counter['queries'] / float(rows) if rows else None,
+        'peak_memory_kb': max_rss_kb(),
+        'memory_growth_kb': max_rss_kb() - start_rss,
+    }
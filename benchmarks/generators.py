@@ -0,0 +1,171 @@
+"""
+Generators of synthetic .csv, .xls and .xlsx files of given size,
+width and mix of columns.
+"""
+import os
+import csv
+import random
+import shutil
+import zipfile
+import tempfile
+from datetime import date, timedelta
+from xml.sax.saxutils import escape
+
+from telega_megaimport.utils import cellname
+
+COLUMN_KINDS = ('string', 'integer', 'float', 'boolean', 'date')
+
+FIRST_DATE = date(2017, 1, 1)
+# Day zero of Excel dates (1900 date system)
+EXCEL_EPOCH = date(1899, 12, 30)
+XLS_MAX_ROWS = 65536
+
+VALUE_MAKERS = {
+    'string': lambda rnd: 'item-{}'.format(rnd.randint(0, 10 ** 6)),
+    'integer': lambda rnd: rnd.randint(-10 ** 6, 10 ** 6),
+    'float': lambda rnd: round(rnd.uniform(-1000, 1000), 3),
+    'boolean': lambda rnd: rnd.choice(('yes', 'no')),
+    'date': lambda rnd: FIRST_DATE + timedelta(days=rnd.randint(0, 3650)),
+}
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>"""
+
+ROOT_RELATIONS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+ xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Data" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+WORKBOOK_RELATIONS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+# Second cell format is date
+STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<cellXfs count="2"><xf numFmtId="0"/><xf numFmtId="14" applyNumberFormat="1"/></cellXfs>
+</styleSheet>"""
+
+
+def column_kinds(mix, width):
+    """
+    Kinds of columns for given width; mix (e.g. 'string,integer')
+    is repeated till width is reached
+    """
+    kinds = mix.split(',') if isinstance(mix, basestring) else list(mix)
+    unknown = set(kinds) - set(COLUMN_KINDS)
+    if unknown:
+        raise ValueError('Unknown column kinds: {}'.format(', '.join(sorted(unknown))))
+    return [kinds[position % len(kinds)] for position in range(width)]
+
+
+def column_titles(kinds):
+    return ['{}_{}'.format(kind, position) for position, kind in enumerate(kinds)]
+
+
+def generate_rows(kinds, rows, seed=0):
+    """
+    Yields rows of random values; the same seed gives the same rows
+    """
+    rnd = random.Random(seed)
+    makers = [VALUE_MAKERS[kind] for kind in kinds]
+    for _ in xrange(rows):
+        yield [make(rnd) for make in makers]
+
+
+def write_csv(path, kinds, rows, seed=0):
+    with open(path, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(column_titles(kinds))
+        for values in generate_rows(kinds, rows, seed):
+            writer.writerow([value.isoformat() if isinstance(value, date) else value for value in values])
+    return path
+
+
+def write_xlsx(path, kinds, rows, seed=0):
+    # Sheet is written to temporary file first, so it's never kept in memory
+    temp_dir = tempfile.mkdtemp()
+    try:
+        sheet_path = os.path.join(temp_dir, 'sheet1.xml')
+        with open(sheet_path, 'wb') as f:
+            _write_xlsx_sheet(f, kinds, rows, seed)
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as book:
+            book.writestr('[Content_Types].xml', CONTENT_TYPES)
+            book.writestr('_rels/.rels', ROOT_RELATIONS)
+            book.writestr('xl/workbook.xml', WORKBOOK)
+            book.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELATIONS)
+            book.writestr('xl/styles.xml', STYLES)
+            book.write(sheet_path, 'xl/worksheets/sheet1.xml')
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return path
+
+
+def _write_xlsx_sheet(f, kinds, rows, seed):
+    f.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            '<dimension ref="A1:{}"/><sheetData>'.format(cellname(rows, len(kinds) - 1)))
+    f.write(_xlsx_row(1, column_titles(kinds)))
+    for rowx, values in enumerate(generate_rows(kinds, rows, seed), 2):
+        f.write(_xlsx_row(rowx, values))
+    f.write('</sheetData></worksheet>')
+
+
+def _xlsx_row(rowx, values):
+    cells = []
+    for value in values:
+        if isinstance(value, date):
+            cells.append('<c s="1"><v>{}</v></c>'.format((value - EXCEL_EPOCH).days))
+        elif isinstance(value, (int, long, float)):
+            cells.append('<c><v>{!r}</v></c>'.format(value))
+        else:
+            cells.append('<c t="inlineStr"><is><t>{}</t></is></c>'.format(escape(value)))
+    return '<row r="{}">{}</row>'.format(rowx, ''.join(cells))
+
+
+def write_xls(path, kinds, rows, seed=0):
+    try:
+        import xlwt
+    except ImportError:
+        raise RuntimeError('Please install xlwt to generate .xls files')
+    if rows + 1 > XLS_MAX_ROWS:
+        raise ValueError('.xls sheet can\'t have more than {} rows'.format(XLS_MAX_ROWS))
+    book = xlwt.Workbook()
+    sheet = book.add_sheet('Data')
+    date_style = xlwt.easyxf(num_format_str='YYYY-MM-DD')
+    for colx, title in enumerate(column_titles(kinds)):
+        sheet.write(0, colx, title)
+    for rowx, values in enumerate(generate_rows(kinds, rows, seed), 1):
+        for colx, value in enumerate(values):
+            if isinstance(value, date):
+                sheet.write(rowx, colx, value, date_style)
+            else:
+                sheet.write(rowx, colx, value)
+    book.save(path)
+    return path
+
+
+WRITERS = {
+    'csv': write_csv,
+    'xls': write_xls,
+    'xlsx': write_xlsx,
+}
+
+
+def write_file(directory, file_format, kinds, rows, seed=0):
+    path = os.path.join(directory, 'benchmark_{}x{}.{}'.format(rows, len(kinds), file_format))
+    return WRITERS[file_format](path, kinds, rows, seed)
@@ -0,0 +1,42 @@
+import csv
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from benchmarks.generators import column_kinds, write_file
+from benchmarks.bench_columns import benchmark_columns
+from benchmarks.bench_parser import run_parser_benchmark
+from telega_megaimport.xlsx import XLSXBook
+
+
+class GeneratorsTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.kinds = column_kinds('string,integer,date', 4)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_kinds(self):
+        self.assertEqual(self.kinds, ['string', 'integer', 'date', 'string'])
+        self.assertRaises(ValueError, column_kinds, 'string,unknown', 2)
+
+    def test_files(self):
+        with open(write_file(self.dir, 'csv', self.kinds, 5)) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ['string_0', 'integer_1', 'date_2', 'string_3'])
+        self.assertEqual(len(rows), 6)
+        sheet = XLSXBook(write_file(self.dir, 'xlsx', self.kinds, 5)).sheet_by_index(0)
+        self.assertEqual((sheet.nrows, sheet.ncols), (6, 4))
+        self.assertEqual([row[0] for row in rows[1:]], [values[0] for values, _ in sheet.get_raw_rows()][1:])
+
+    def test_parser_benchmark(self):
+        path = write_file(self.dir, 'xlsx', self.kinds, 5)
+        result = run_parser_benchmark(path, self.kinds, 'sink', 5, {'chunk_size': 2})
+        self.assertEqual((result['format'], result['parsed_successfully']), ('xlsx', 5))
+        self.assertGreater(result['queries_per_row'], 0)
+
+    def test_column_benchmarks(self):
+        results = benchmark_columns(values=10)
+        self.assertIn(('DateTimeColumn(formats)', 'clean'), [(result['column'], result['method']) for result in results])
@@ -0,0 +1,110 @@
+"""
+Benchmarks of columns and parsers on synthetic files.
+Results are written as JSON, e.g.:
+
+    python runbenchmarks.py --rows 100000 --width 20 --formats csv,xlsx --output results.json
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import platform
+import multiprocessing
+
+from django.conf import settings
+import django
+
+from runtests import DEFAULT_SETTINGS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='Rows in generated files')
+    parser.add_argument('--width', type=int, default=10, help='Columns in generated files')
+    parser.add_argument('--mix', default='string,integer,float,boolean,date',
+                        help='Kinds of columns, repeated till width is reached')
+    parser.add_argument('--formats', default='csv,xlsx', help='Formats of files: csv, xls (xlwt required), xlsx')
+    parser.add_argument('--modes', default='noop,row,sink',
+                        help='noop only parses rows, row creates object per row, sink inserts them in bulk')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='--chunk-size option of parser')
+    parser.add_argument('--column-values', type=int, default=10000, help='Values for column micro-benchmarks')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='File for JSON results; stdout by default')
+    return parser.parse_args()
+
+
+def setup_django(database):
+    benchmark_settings = dict(DEFAULT_SETTINGS)
+    benchmark_settings['DATABASES'] = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': database,
+        }
+    }
+    settings.configure(**benchmark_settings)
+    if hasattr(django, 'setup'):
+        django.setup()
+    from django.core.management import call_command
+    options = {'run_syncdb': True} if django.VERSION >= (1, 9) else {}
+    call_command('migrate', verbosity=0, interactive=False, **options)
+
+
+def run_isolated(function, *args):
+    # Every parser runs in its own process, so peak memory isn't affected by previous runs
+    from django.db import connections
+    connections.close_all()
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(function, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_benchmarks(args, directory):
+    from benchmarks.generators import column_kinds, write_file
+    from benchmarks.bench_columns import benchmark_columns
+    from benchmarks.bench_parser import run_parser_benchmark
+
+    kinds = column_kinds(args.mix, args.width)
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+        },
+        'parameters': vars(args),
+        'columns': benchmark_columns(args.column_values, args.seed, with_models=True),
+        'parsers': [],
+    }
+    for file_format in args.formats.split(','):
+        path = write_file(directory, file_format, kinds, args.rows, args.seed)
+        for mode in args.modes.split(','):
+            for options in ({}, {'chunk_size': args.chunk_size}):
+                results['parsers'].append(
+                    run_isolated(run_parser_benchmark, path, kinds, mode, args.rows, options)
+                )
+    return results
+
+
+def main():
+    args = parse_args()
+    directory = tempfile.mkdtemp()
+    try:
+        setup_django(os.path.join(directory, 'benchmarks.sqlite3'))
+        results = run_benchmarks(args, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        json.dump(results, output, indent=2, sort_keys=True)
+        output.write('\n')
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
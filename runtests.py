@@ -44,7 +44,8 @@ def runtests():
     try:
         from django.test.runner import DiscoverRunner
         runner_class = DiscoverRunner
-        test_args = ['telega_megaimport.tests']
+        # Benchmarks aren't installed with package, so their tests are kept along with them
+        test_args = ['telega_megaimport.tests', 'benchmarks']
     except ImportError:
         from django.test.simple import DjangoTestSuiteRunner
         runner_class = DjangoTestSuiteRunner
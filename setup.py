@@ -24,7 +24,7 @@ setup(name='telega_megaimport',
       author='Andrew Liashchuk @ DjangoStars',
       author_email='andrew.luashchuk@djangostars.com',
       license='MIT',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks']),
       install_requires=[
           'Django>=1.7',
           'xlrd',
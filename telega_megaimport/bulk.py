@@ -0,0 +1,261 @@
+import datetime
+import decimal
+import operator
+import uuid
+from io import BytesIO
+from collections import OrderedDict
+
+from django.db import connections, router, transaction
+from django.db.models import AutoField, Q
+from django.db.models.fields import FieldDoesNotExist
+from django.utils import six
+from django.utils.encoding import force_bytes
+
+
+COPY_TYPES = six.string_types + six.integer_types + (
+    six.binary_type, float, bool, decimal.Decimal, datetime.date, datetime.time, uuid.UUID
+)
+
+UPSERT_COUNTERS = ('inserted', 'updated', 'unchanged')
+
+# Comparison, which treats two NULLs as equal
+NULL_SAFE_EQUAL = {
+    'sqlite': 'IS',
+    'postgresql': 'IS NOT DISTINCT FROM',
+}
+
+
+def bulk_insert(objects, batch_size=None):
+    """
+    Insert unsaved model instances, grouped by model.
+    Uses executemany on SQLite, COPY on PostgreSQL and
+    bulk_create on other backends.
+    """
+    groups = OrderedDict()
+    for obj in objects:
+        groups.setdefault(type(obj), []).append(obj)
+    for model, objs in groups.items():
+        using = router.db_for_write(model)
+        connection = connections[using]
+        insert = INSERTERS.get(connection.vendor)
+        if insert is None or model._meta.parents:
+            model._base_manager.using(using).bulk_create(objs, batch_size=batch_size)
+            continue
+        for fields, group in _split_by_pk(model, objs):
+            step = batch_size or len(group)
+            for start in range(0, len(group), step):
+                batch = group[start:start + step]
+                try:
+                    insert(connection, model._meta.db_table, fields,
+                           [_prepare_values(obj, fields, connection) for obj in batch])
+                except TypeError:
+                    # Value can't be passed in plain form, let Django adapt it
+                    model._base_manager.using(using).bulk_create(batch)
+
+
+def bulk_upsert(objects, keys, batch_size=None, fields=None):
+    """
+    Insert unsaved model instances or update objects with the same
+    values of key fields, grouped by model. Every batch is loaded into
+    temporary staging table and merged by single INSERT ... ON CONFLICT
+    DO UPDATE on SQLite and PostgreSQL; other backends look up existing
+    objects and fall back to bulk_create and update of changed ones.
+    Only `fields` (names of fields) of existing objects are compared and
+    updated, if given, and all of their fields otherwise.
+    Returns amounts of inserted, updated and unchanged objects.
+    """
+    counts = dict.fromkeys(UPSERT_COUNTERS, 0)
+    groups = OrderedDict()
+    for obj in objects:
+        groups.setdefault(type(obj), []).append(obj)
+    for model, objs in groups.items():
+        key_fields = upsert_key_fields(model, keys)
+        using = router.db_for_write(model)
+        connection = connections[using]
+        merge = _merge_with_orm
+        if _supports_on_conflict(connection) and not model._meta.parents:
+            merge = _merge_with_staging
+        # The same object can't be updated twice by one statement, so only the last one is kept
+        objs = list(OrderedDict((_key(obj, key_fields), obj) for obj in objs).values())
+        step = batch_size or len(objs)
+        for start in range(0, len(objs), step):
+            with transaction.atomic(using=using):
+                batch_counts = merge(connection, model, key_fields, objs[start:start + step], fields)
+            for counter, value in batch_counts.items():
+                counts[counter] += value
+    return counts
+
+
+def upsert_key_fields(model, keys):
+    """
+    Fields of model by names of keys; raises ValueError, unless
+    they are unique together, as required by ON CONFLICT
+    """
+    try:
+        key_fields = [model._meta.get_field(name) for name in keys]
+    except FieldDoesNotExist, e:
+        raise ValueError(str(e))
+    if not _is_unique_together(model, key_fields):
+        raise ValueError('Fields {} of {} are not unique together'.format(', '.join(keys), model.__name__))
+    return key_fields
+
+
+def _is_unique_together(model, key_fields):
+    # Conflict target must match unique constraint exactly
+    if len(key_fields) == 1 and key_fields[0].unique:
+        return True
+    names = set(field.name for field in key_fields)
+    return any(set(unique) == names for unique in model._meta.unique_together)
+
+
+def _supports_on_conflict(connection):
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 24, 0)
+    if connection.vendor == 'postgresql':
+        return connection.pg_version >= 90500
+    return False
+
+
+def _key(obj, key_fields):
+    return tuple(getattr(obj, field.attname) for field in key_fields)
+
+
+def _upsert_fields(model, key_fields, names=None):
+    fields = [field for field in model._meta.concrete_fields if not isinstance(field, AutoField)]
+    # Creation time of existing objects is kept, fields, which weren't given, aren't reset to defaults
+    update_fields = [field for field in fields
+                     if field not in key_fields and not getattr(field, 'auto_now_add', False) and (
+                         names is None or field.name in names or field.attname in names or
+                         getattr(field, 'auto_now', False)
+                     )]
+    return fields, update_fields
+
+
+def _merge_with_staging(connection, model, key_fields, objs, names=None):
+    fields, update_fields = _upsert_fields(model, key_fields, names)
+    quote_name = connection.ops.quote_name
+    same = NULL_SAFE_EQUAL[connection.vendor]
+    table = quote_name(model._meta.db_table)
+    staging_table = model._meta.db_table + '_staging'
+    staging = quote_name(staging_table)
+    columns = ', '.join(quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        # Staging table has the same columns, but no constraints; it's dropped by rollback on error
+        cursor.execute('CREATE TEMPORARY TABLE {} AS SELECT {} FROM {} WHERE 1 = 0'.format(staging, columns, table))
+        try:
+            INSERTERS[connection.vendor](
+                connection, staging_table, fields, [_prepare_values(obj, fields, connection) for obj in objs]
+            )
+        except TypeError:
+            # Value can't be passed in plain form, so it's left to Django to adapt it
+            cursor.execute('DROP TABLE {}'.format(staging))
+            return _merge_with_orm(connection, model, key_fields, objs, names)
+        cursor.execute(
+            'SELECT COUNT(*), COALESCE(SUM(CASE WHEN {} THEN 1 ELSE 0 END), 0) '
+            'FROM {} s JOIN {} t ON {}'.format(
+                ' AND '.join('t.{0} {1} s.{0}'.format(quote_name(field.column), same)
+                             for field in update_fields) or '1 = 1',
+                staging, table,
+                ' AND '.join('t.{0} = s.{0}'.format(quote_name(field.column)) for field in key_fields),
+            )
+        )
+        matched, unchanged = cursor.fetchone()
+        action = 'DO NOTHING'
+        if update_fields:
+            # Unchanged rows aren't rewritten
+            action = 'DO UPDATE SET {} WHERE NOT ({})'.format(
+                ', '.join('{0} = excluded.{0}'.format(quote_name(field.column)) for field in update_fields),
+                ' AND '.join('{0}.{1} {2} excluded.{1}'.format(table, quote_name(field.column), same)
+                             for field in update_fields),
+            )
+        # WHERE tells SQLite, that ON CONFLICT doesn't belong to join
+        cursor.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {2} WHERE 1 = 1 ON CONFLICT ({3}) {4}'.format(
+            table, columns, staging, ', '.join(quote_name(field.column) for field in key_fields), action
+        ))
+        cursor.execute('DROP TABLE {}'.format(staging))
+    return {'inserted': len(objs) - matched, 'updated': matched - unchanged, 'unchanged': unchanged}
+
+
+def _merge_with_orm(connection, model, key_fields, objs, names=None):
+    fields, update_fields = _upsert_fields(model, key_fields, names)
+    manager = model._base_manager.using(connection.alias)
+    keys = [_key(obj, key_fields) for obj in objs]
+    if len(key_fields) == 1:
+        queryset = manager.filter(**{key_fields[0].attname + '__in': [key for key, in keys]})
+    else:
+        attnames = [field.attname for field in key_fields]
+        queryset = manager.filter(reduce(operator.or_, (Q(**dict(zip(attnames, key))) for key in keys)))
+    existing = dict((_key(current, key_fields), current) for current in queryset)
+    created, changed = [], []
+    for key, obj in zip(keys, objs):
+        current = existing.get(key)
+        if current is None:
+            created.append(obj)
+        elif any(getattr(current, field.attname) != getattr(obj, field.attname) for field in update_fields):
+            obj.pk = current.pk
+            changed.append(obj)
+    manager.bulk_create(created)
+    if hasattr(manager, 'bulk_update'):
+        manager.bulk_update(changed, [field.name for field in update_fields])
+    else:
+        # QuerySet.bulk_update appeared in Django 2.2
+        for obj in changed:
+            manager.filter(pk=obj.pk).update(**dict((field.attname, getattr(obj, field.attname))
+                                                    for field in update_fields))
+    return {'inserted': len(created), 'updated': len(changed), 'unchanged': len(objs) - len(created) - len(changed)}
+
+
+def _split_by_pk(model, objs):
+    # Just like bulk_create, primary key is passed only if it's set
+    fields = model._meta.concrete_fields
+    with_pk = [obj for obj in objs if obj.pk is not None]
+    without_pk = [obj for obj in objs if obj.pk is None]
+    if with_pk:
+        yield fields, with_pk
+    if without_pk:
+        yield [field for field in fields if not isinstance(field, AutoField)], without_pk
+
+
+def _prepare_values(obj, fields, connection):
+    return [field.get_db_prep_save(field.pre_save(obj, True), connection=connection) for field in fields]
+
+
+def _insert_sql(connection, table, fields):
+    quote_name = connection.ops.quote_name
+    return '{} ({})'.format(
+        quote_name(table),
+        ', '.join(quote_name(field.column) for field in fields)
+    )
+
+
+def _executemany_insert(connection, table, fields, rows):
+    sql = 'INSERT INTO {} VALUES ({})'.format(
+        _insert_sql(connection, table, fields),
+        ', '.join(['%s'] * len(fields))
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _copy_insert(connection, table, fields, rows):
+    data = BytesIO()
+    for row in rows:
+        data.write(b','.join(_copy_value(value) for value in row) + b'\n')
+    data.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert('COPY {} FROM STDIN WITH CSV'.format(_insert_sql(connection, table, fields)), data)
+
+
+def _copy_value(value):
+    # Unquoted empty value is NULL in CSV format of COPY, quoted one is empty string
+    if value is None:
+        return b''
+    if not isinstance(value, COPY_TYPES):
+        raise TypeError('Value of type {} can\'t be copied'.format(type(value)))
+    return b'"' + force_bytes(value).replace(b'"', b'""') + b'"'
+
+
+INSERTERS = {
+    'sqlite': _executemany_insert,
+    'postgresql': _copy_insert,
+}
@@ -1,15 +1,58 @@
+from datetime import datetime
+from collections import defaultdict
 from dateutil import parser
 
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned, ValidationError
+from django.db.models import F
+from django.db.models.fields import FieldDoesNotExist
+from django.utils.encoding import force_text
+from django.utils import six
 from django.apps import apps
 
+from utils import LRUCache
+
+# Annotation of objects of ModelColumn with their value of lookup
+PREFETCH_KEY = 'megaimport_lookup_key'
+
+# Bounds of numpy.int64 as floats; NaN is out of them too
+INT64_MIN, INT64_MAX = -2.0 ** 63, 2.0 ** 63
+
+# xlrd.XL_CELL_DATE; xlrd itself is imported only for date cells of spreadsheets
+XL_CELL_DATE = 3
+
+
+def _coerce_batch(values, dtype):
+    """
+    Convert slice of column to numpy dtype at once. Returns list of
+    converted values and mask of positions, which can't be converted.
+    """
+    import numpy
+    result = [None] * len(values)
+    invalid = [False] * len(values)
+    # Slice is halved until failed values are found, so few invalid cells don't spoil the whole batch
+    stack = [(0, len(values))]
+    while stack:
+        start, stop = stack.pop()
+        try:
+            result[start:stop] = numpy.array(values[start:stop]).astype(dtype).tolist()
+        except (ValueError, TypeError, OverflowError):
+            if stop - start == 1:
+                invalid[start] = True
+            else:
+                middle = (start + stop) // 2
+                stack.append((middle, stop))
+                stack.append((start, middle))
+    return result, invalid
+
 
 class BaseColumn(object):
     """
     Base class for inheritance for Cell creation
 
     Don't forget to override kls.normalize(value) and
-    kls.validate(value) if required
+    kls.validate(value) if required; kls.clean(value) may be
+    overridden to do both in one pass, kls.clean_batch(values)
+    to clean whole slice of column at once
     """
     # Counter is added for ordering of field-declaration
     creation_counter = 0
@@ -23,6 +66,14 @@ class BaseColumn(object):
         self.title = None
         self.required = required
         self.default = default
+        # Subclass, that overrides only validate/normalize of column with
+        # one-pass clean, should still be cleaned via its own methods
+        if self._is_outdated('clean', ('validate', 'normalize')):
+            self.clean = BaseColumn.clean.__get__(self, type(self))
+        if self._is_outdated('clean_batch', ('clean', 'validate', 'normalize')):
+            self.clean_batch = BaseColumn.clean_batch.__get__(self, type(self))
+        if self._is_outdated('clean_cell', ('clean', 'validate', 'normalize')):
+            self.clean_cell = BaseColumn.clean_cell.__get__(self, type(self))
 
     def __repr__(self):
         return "<{}: {}{}>".format(
@@ -41,6 +92,32 @@ class BaseColumn(object):
             return ['Empty value']
         return None
 
+    def clean(self, value):
+        # Return tuple of normalized value and errors (same as validate returns)
+        errors = self.validate(value)
+        if errors:
+            return None, errors
+        return self.normalize(value), None
+
+    def clean_cell(self, value, ctype, datemode):
+        # Same as clean, but for spreadsheet cell of given xlrd type;
+        # override to handle raw cell values (e.g. dates) natively
+        return self.clean(value)
+
+    def clean_batch(self, values):
+        # Return list of normalized values and mask of invalid ones,
+        # which are cleaned by clean(value) to get errors
+        return list(values), [True] * len(values)
+
+    def _is_outdated(self, method, overrides):
+        for klass in type(self).__mro__:
+            attrs = vars(klass)
+            if method in attrs:
+                return False
+            if any(name in attrs for name in overrides):
+                return True
+        return False
+
 
 class EmptyColumn(BaseColumn):
     """
@@ -106,6 +183,29 @@ class BooleanColumn(BaseColumn):
         else:
             return None
 
+    def clean(self, value):
+        error = super(BooleanColumn, self).validate(value) or []
+        value = value.lower() if not isinstance(value, bool) else value
+        if value in self.true_values:
+            value = True
+        elif value in self.false_values:
+            value = False
+        else:
+            error += ['Value cannot be parsed as boolean']
+        if error:
+            return None, error
+        return value, None
+
+    def clean_batch(self, values):
+        import numpy
+        # Non-string values (e.g. booleans) would be stringified by numpy
+        if not set(map(type, values)).issubset((six.binary_type, six.text_type)):
+            return super(BooleanColumn, self).clean_batch(values)
+        array = numpy.char.lower(numpy.array(values))
+        true_mask = numpy.in1d(array, self.true_values)
+        invalid = ~(true_mask | numpy.in1d(array, self.false_values))
+        return true_mask.tolist(), invalid.tolist()
+
 
 class IntegerColumn(BaseColumn):
     """
@@ -130,6 +230,27 @@ class IntegerColumn(BaseColumn):
         else:
             return None
 
+    def clean(self, value):
+        error = super(IntegerColumn, self).validate(value) or []
+        try:
+            value = int(value)
+        except ValueError:
+            error += ['Not convertable to integer']
+        if error:
+            return None, error
+        return value, None
+
+    def clean_batch(self, values):
+        import numpy
+        # numpy casts floats, which are not finite or don't fit in int64, without error,
+        # so they are left to clean(value)
+        unfit = [isinstance(value, float) and not INT64_MIN <= value < INT64_MAX for value in values]
+        if not any(unfit):
+            return _coerce_batch(values, numpy.int64)
+        result, invalid = _coerce_batch([0 if failed else value for value, failed in zip(values, unfit)],
+                                        numpy.int64)
+        return result, [failed or out_of_range for failed, out_of_range in zip(invalid, unfit)]
+
 
 class FloatColumn(BaseColumn):
     """
@@ -154,32 +275,52 @@ class FloatColumn(BaseColumn):
         else:
             return None
 
+    def clean(self, value):
+        error = super(FloatColumn, self).validate(value) or []
+        try:
+            value = float(value)
+        except ValueError:
+            error += ['Not convertable to float']
+        if error:
+            return None, error
+        return value, None
+
+    def clean_batch(self, values):
+        import numpy
+        return _coerce_batch(values, numpy.float64)
+
 
 class ModelColumn(BaseColumn):
     """
     Use for parsing direct model association. Always set queryset;
     default lookup argument - primary key.
+    Set prefetch=True to resolve lookups for a chunk of rows with
+    a single query (exact field lookups only).
     Returns model instance.
     """
-    def __init__(self, queryset=None, lookup_arg='pk', *args, **kwargs):
+    def __init__(self, queryset=None, lookup_arg='pk', prefetch=False, *args, **kwargs):
         self.queryset = queryset
         if queryset is None:
             raise ValueError('Queryset is required!')
         self.lookup_arg = lookup_arg
+        self.prefetch = prefetch
+        self._cache = None
         super(ModelColumn, self).__init__(*args, **kwargs)
 
     def normalize(self, value):
         try:
-            return self.queryset.get(**{self.lookup_arg: value})
+            return self._get_object(value)
         except ObjectDoesNotExist:
             return None
 
     def validate(self, value):
         error = super(ModelColumn, self).validate(value) or []
         try:
-            self.queryset.get(**{self.lookup_arg: value})
+            self._get_object(value)
         except ObjectDoesNotExist:
             error += ['Object not found']
+        except MultipleObjectsReturned:
+            error += ['Multiple objects found']
         except ValueError:
             error += ['Invalid lookup']
         if error:
@@ -187,13 +328,92 @@ class ModelColumn(BaseColumn):
         else:
             return None
 
+    def clean(self, value):
+        error = super(ModelColumn, self).validate(value) or []
+        try:
+            value = self._get_object(value)
+        except ObjectDoesNotExist:
+            error += ['Object not found']
+        except MultipleObjectsReturned:
+            error += ['Multiple objects found']
+        except ValueError:
+            error += ['Invalid lookup']
+        if error:
+            return None, error
+        return value, None
+
+    def prefetch_objects(self, values, batch_size=None):
+        """
+            Resolve given lookup values with a single query (or one per
+            `batch_size` values) and keep results for following
+            validate/normalize calls.
+        """
+        field = self._get_lookup_field()
+        cache = {}
+        keys = {}
+        for value in set(values):
+            try:
+                keys[value] = self._make_key(field.to_python(value))
+            except (ValidationError, ValueError, TypeError):
+                # Will be reported as invalid lookup
+                cache[value] = None
+        found = defaultdict(list)
+        distinct_keys = list(set(keys.values()))
+        step = batch_size or len(distinct_keys)
+        for start in range(0, len(distinct_keys), step):
+            # Lookup may span relations, so its value is selected along with objects
+            queryset = self.queryset.filter(**{'{}__in'.format(self.lookup_arg): distinct_keys[start:start + step]})
+            for obj in queryset.annotate(**{PREFETCH_KEY: F(self.lookup_arg)}):
+                found[self._make_key(getattr(obj, PREFETCH_KEY))].append(obj)
+        for value, key in keys.items():
+            cache[value] = found.get(key, [])
+        self._cache = cache
+
+    def _get_object(self, value):
+        if self._cache is None or value not in self._cache:
+            return self.queryset.get(**{self.lookup_arg: value})
+        objects = self._cache[value]
+        if objects is None:
+            raise ValueError('Invalid lookup')
+        if not objects:
+            raise self.queryset.model.DoesNotExist
+        if len(objects) > 1:
+            raise self.queryset.model.MultipleObjectsReturned
+        return objects[0]
+
+    def _get_lookup_field(self):
+        model = self.queryset.model
+        field = None
+        try:
+            for part in self.lookup_arg.split('__'):
+                if field is not None:
+                    model = field.related_model
+                field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+        except (FieldDoesNotExist, AttributeError):
+            raise ValueError('Lookup `{}` can\'t be prefetched, use exact field lookup'.format(self.lookup_arg))
+        if not hasattr(field, 'to_python'):
+            raise ValueError('Lookup `{}` can\'t be prefetched, use exact field lookup'.format(self.lookup_arg))
+        return field
+
+    @staticmethod
+    def _make_key(value):
+        # Database returns text, while file cells may come as bytes
+        if isinstance(value, six.binary_type):
+            return force_text(value)
+        return value
+
 
 class DateTimeColumn(BaseColumn):
     """
         Used for parsing date time values;
+        `formats` are tried with strptime before dateutil parser,
+        results for last `cache_size` strings are cached.
     """
 
     def __init__(self, *args, **kwargs):
+        self.formats = kwargs.pop('formats', None) or []
+        self.cache = LRUCache(kwargs.pop('cache_size', 1000))
+        self.statistics = {'cache_hits': 0, 'cache_misses': 0}
         self.parserinfo = kwargs.pop('parserinfo', None)
         self.ignoretz = kwargs.pop('ignoretz', False)
         self.tzinfos = kwargs.pop('tzinfos', None)
@@ -203,6 +423,29 @@ class DateTimeColumn(BaseColumn):
         super(DateTimeColumn, self).__init__(*args, **kwargs)
 
     def normalize(self, value):
+        if not self.cache.size or not isinstance(value, six.string_types):
+            return self._parse(value)
+        try:
+            dt = self.cache[value]
+            self.statistics['cache_hits'] += 1
+        except KeyError:
+            self.statistics['cache_misses'] += 1
+            try:
+                dt = self._parse(value)
+            except (OverflowError, ValueError) as e:
+                dt = e
+            self.cache[value] = dt
+        if isinstance(dt, Exception):
+            raise dt
+        return dt
+
+    def _parse(self, value):
+        if isinstance(value, six.string_types):
+            for date_format in self.formats:
+                try:
+                    return datetime.strptime(value, date_format)
+                except ValueError:
+                    pass
         dt = parser.parse(
             value, parserinfo=self.parserinfo, ignoretz=self.ignoretz, tzinfos=self.tzinfos, dayfirst=self.dayfirst,
             yearfirst=self.yearfirst, fuzzy=self.fuzzy
@@ -217,6 +460,27 @@ class DateTimeColumn(BaseColumn):
             errors.append(e.message) if errors is not None else [e.message]
         return errors if errors else None
 
+    def clean(self, value):
+        errors = super(DateTimeColumn, self).validate(value) or []
+        try:
+            value = self.normalize(value)
+        except (OverflowError, ValueError) as e:
+            errors.append(e.message)
+        if errors:
+            return None, errors
+        return value, None
+
+    def clean_cell(self, value, ctype, datemode):
+        # Excel dates are stored as float serials; no need to parse strings
+        if ctype != XL_CELL_DATE:
+            return self.clean(value)
+        from xlrd import xldate_as_datetime
+        from xlrd.xldate import XLDateError
+        try:
+            return xldate_as_datetime(value, datemode), None
+        except (XLDateError, OverflowError, ValueError) as e:
+            return None, [str(e) or 'Invalid date']
+
 
 class ModelTypeColumn(BaseColumn):
     """
@@ -253,7 +517,7 @@ class ModelTypeColumn(BaseColumn):
                 error += ['Model not found']
         else:
             try:
-                return self._get_model(value)
+                self._get_model(value)
             except LookupError:
                 error += ['Model not found']
             except ValueError:
@@ -263,6 +527,21 @@ class ModelTypeColumn(BaseColumn):
         else:
             return None
 
+    def clean(self, value):
+        error = super(ModelTypeColumn, self).validate(value) or []
+        try:
+            if self.applabel:
+                value = apps.get_model(self.applabel, value)
+            else:
+                value = self._get_model(value)
+        except LookupError:
+            error += ['Model not found']
+        except ValueError:
+            error += ['Ambigious model, specify applabel']
+        if error:
+            return None, error
+        return value, None
+
     def _get_model(self, value):
         value = value.lower()
 
@@ -0,0 +1,112 @@
+"""
+Streaming decompression of compressed text files (e.g. data.csv.gz),
+so they are parsed without being decompressed to disk first.
+"""
+import os
+import bz2
+import zlib
+
+from django.core.management import CommandError
+
+# Extension of compressed file -> compression
+COMPRESSIONS = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.zst': 'zstd',
+}
+
+
+def split_compression(name):
+    """
+    Name of file (or format) without extension of compression and
+    compression itself: 'data.csv.gz' -> ('data.csv', 'gzip')
+    """
+    base, extension = os.path.splitext(name)
+    compression = COMPRESSIONS.get(extension.lower())
+    if compression is None:
+        return name, None
+    return base, compression
+
+
+def _gzip_decompressor():
+    # 16 + MAX_WBITS makes zlib expect gzip header and trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def _xz_decompressor():
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise CommandError('No lzma package found! Please, install backports.lzma to parse .xz files')
+    return lzma.LZMADecompressor()
+
+
+def _zstd_decompressor():
+    try:
+        import zstandard
+    except ImportError:
+        raise CommandError('No zstandard package found! Please, install it to parse .zst files')
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+DECOMPRESSORS = {
+    'gzip': _gzip_decompressor,
+    'bz2': bz2.BZ2Decompressor,
+    'xz': _xz_decompressor,
+    'zstd': _zstd_decompressor,
+}
+
+
+class DecompressingFile(object):
+    """
+    Lines of compressed file, which are decompressed block by block;
+    `compressed_read` is amount of compressed bytes consumed so far
+    """
+    block_size = 1 << 16
+
+    def __init__(self, raw, compression):
+        self.raw = raw
+        self.new_decompressor = DECOMPRESSORS[compression]
+        # Dependency is checked before parsing is started
+        self.decompressor = self.new_decompressor()
+        self.compressed_read = 0
+
+    def __iter__(self):
+        tail = b''
+        for data in self.__blocks():
+            # Lines are split by '\n' only, just like lines of file object
+            lines = (tail + data).split(b'\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if tail:
+            yield tail
+
+    def __blocks(self):
+        decompressor = self.decompressor
+        while True:
+            block = self.raw.read(self.block_size)
+            if not block:
+                return
+            self.compressed_read += len(block)
+            try:
+                data = decompressor.decompress(block)
+            except EOFError:
+                # Previous stream of bz2 or xz ended exactly at the end of block
+                decompressor = self.new_decompressor()
+                data = decompressor.decompress(block)
+            # Concatenated streams (e.g. of `cat a.gz b.gz`) are decompressed one after another
+            unused = getattr(decompressor, 'unused_data', b'')
+            while unused:
+                decompressor = self.new_decompressor()
+                data += decompressor.decompress(unused)
+                unused = getattr(decompressor, 'unused_data', b'')
+            if data:
+                yield data
+
+    def close(self):
+        self.raw.close()
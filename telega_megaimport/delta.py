@@ -0,0 +1,77 @@
+import os
+import struct
+import sqlite3
+import hashlib
+
+from django.utils.encoding import force_text
+
+
+def fingerprint(row):
+    """
+    Compact fingerprint of raw values of row: 64-bit integer
+    """
+    return struct.unpack('<q', hashlib.md5(repr(tuple(row))).digest()[:8])[0]
+
+
+def file_checksum(filename, block_size=1 << 20):
+    checksum = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+class FingerprintStore(object):
+    """
+    SQLite sidecar with fingerprints of rows imported by parser,
+    keyed by natural key, and checksum of last imported file.
+    """
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self._connection = None
+        self._pid = None
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS files (source TEXT PRIMARY KEY, checksum TEXT)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS rows '
+                '(source TEXT, key TEXT, fingerprint INTEGER, PRIMARY KEY (source, key))'
+            )
+
+    @property
+    def connection(self):
+        # Forked worker process opens its own connection
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path)
+            self._pid = os.getpid()
+        return self._connection
+
+    def get_checksum(self):
+        row = self.connection.execute('SELECT checksum FROM files WHERE source = ?', (self.source,)).fetchone()
+        return row[0] if row else None
+
+    def set_checksum(self, checksum):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO files (source, checksum) VALUES (?, ?)', (self.source, checksum)
+            )
+
+    def is_unchanged(self, key, row_fingerprint):
+        row = self.connection.execute(
+            'SELECT fingerprint FROM rows WHERE source = ? AND key = ?', (self.source, force_text(key))
+        ).fetchone()
+        return row is not None and row[0] == row_fingerprint
+
+    def save(self, fingerprints):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO rows (source, key, fingerprint) VALUES (?, ?, ?)',
+                ((self.source, force_text(key), row_fingerprint) for key, row_fingerprint in fingerprints)
+            )
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
@@ -1,20 +1,85 @@
-import csv
+import sys
+import json
 import time
 import django
+import logging
+import threading
 import os.path
+import multiprocessing
 
+from multiprocessing.pool import ThreadPool
 from optparse import make_option
-from columns import BaseColumn, EmptyColumn, StatusColumn
-from collections import OrderedDict
-from xlrd import open_workbook
+from columns import BaseColumn, EmptyColumn, StatusColumn, ModelColumn
+from collections import OrderedDict, deque, namedtuple
+from itertools import islice
 from django.core.management import BaseCommand, CommandError
+from django.utils import six
 from django.utils.six import with_metaclass
 from django.utils import timezone
-from django.db import transaction
+from django.db import transaction, connections, DEFAULT_DB_ALIAS
+from django.db.models.fields import FieldDoesNotExist
 from django.conf import settings
 from distutils.version import StrictVersion
 
-from utils import UnicodeWriter
+from bulk import bulk_insert, bulk_upsert, upsert_key_fields, UPSERT_COUNTERS
+from compression import DecompressingFile, split_compression
+from delta import FingerprintStore, fingerprint, file_checksum
+from profiler import Profiler, ProfiledColumn
+from readers import get_reader, format_of
+from utils import UnicodeWriter, SheetRow, cellname
+
+logger = logging.getLogger('telega_megaimport')
+# Failures are logged separately, so they can be routed to their own handler
+failure_logger = logging.getLogger('telega_megaimport.failures')
+# Nothing is written, unless logging is configured or parser is run as command
+logger.addHandler(logging.NullHandler())
+
+# Django verbosity option to logging level
+LOG_LEVELS = {
+    0: logging.WARNING,
+    1: logging.INFO,
+    2: logging.INFO,
+    3: logging.DEBUG,
+}
+
+
+# Result of single row yielded by BaseParser.parse; status is 'Success', 'Failure' or 'Skipped';
+# message of 'Success' is set, if row had invalid cells
+RowResult = namedtuple('RowResult', ('row_number', 'status', 'message', 'row'))
+
+
+# Parser, which is inherited by forked worker processes
+_worker_parser = None
+# Connections of parent process must not be closed by workers
+_parent_connections = []
+
+
+class _ThreadBarrier(object):
+    """
+    Closes connections of calling thread and waits till all `parties`
+    threads do it, so no thread of pool runs the task twice
+    """
+    def __init__(self, parties):
+        self.left = parties
+        self.condition = threading.Condition()
+
+    def close_connections(self, _):
+        connections.close_all()
+        with self.condition:
+            self.left -= 1
+            self.condition.notify_all()
+            while self.left:
+                self.condition.wait()
+
+
+def _init_worker():
+    # Every worker opens its own database connections
+    _parent_connections.extend(connections.all())
+    connections._connections = type(connections._connections)()
+
+
+def _parse_chunk_in_worker(chunk, total_rows):
+    return _worker_parser.parse_chunk(chunk, total_rows)
 
 
 class ParserMetaclass(type):
@@ -32,6 +97,36 @@ class ParserMetaclass(type):
 
 
 class BaseParser(with_metaclass(ParserMetaclass, BaseCommand)):
+    # Amount of rows, for which ModelColumn(prefetch=True) lookups are resolved by one query;
+    # lookups of whole --chunk-size chunk are resolved before it's parsed
+    prefetch_chunk_size = 1000
+    # Model, which is created from dicts returned by sink(values)
+    sink_model = None
+    # Amount of objects returned by sink(values), which are inserted at once
+    sink_batch_size = 1000
+    # Fields of model, which identify existing objects; when set, objects
+    # returned by sink(values) are updated if they exist and inserted otherwise
+    upsert_keys = ()
+    # Fields of model, which are updated for existing objects; by default these are keys
+    # of dicts returned by sink(values) and all fields of returned model instances
+    upsert_fields = None
+    # Amount of rows sent to worker process at once, unless --chunk-size is set
+    worker_chunk_size = 1000
+    # Amount of Google Spreadsheet rows fetched with single request
+    gsheet_page_size = 1000
+    # Amount of rows, for which columns are cleaned at once in --batch mode
+    batch_chunk_size = 1000
+    # Title of column, which identifies row between imports in --delta mode
+    delta_key = None
+    # Amount of fingerprints of imported rows, which are saved at once in --delta mode
+    delta_batch_size = 1000
+    # Seconds between progress summaries logged during parsing
+    summary_interval = 10
+    # Amount of first failures, which are logged; further failures are sampled
+    failure_log_limit = 10
+    # Only every N-th failure is logged after failure_log_limit is reached
+    failure_log_every = 100
+
     def __init__(self, *args, **kwargs):
         super(BaseParser, self).__init__(*args, **kwargs)
         # For compatibility with Django 1.7
@@ -73,7 +168,65 @@ class BaseParser(with_metaclass(ParserMetaclass, BaseCommand)):
                 make_option(
                     '--google_spreadsheet',
                     default=False,
-                    help='Are you parsing Google Spreadsheet directly? Gspread required')
+                    help='Are you parsing Google Spreadsheet directly? Gspread required'),
+                make_option(
+                    '--stream',
+                    default=False,
+                    help='Read csv file in a single pass? Progress is tracked by bytes read'
+                ),
+                make_option(
+                    '--chunk-size',
+                    type='int',
+                    default=0,
+                    help='Commit every N rows in single transaction'
+                ),
+                make_option(
+                    '--workers',
+                    type='int',
+                    default=0,
+                    help='Parse chunks of rows in N processes'
+                ),
+                make_option(
+                    '--ordered',
+                    default=True,
+                    help='Merge results of workers in order of rows?'
+                ),
+                make_option(
+                    '--batch',
+                    default=False,
+                    help='Clean numeric and boolean columns of chunk of rows at once? (numpy required)'
+                ),
+                make_option(
+                    '--checkpoint',
+                    default=None,
+                    help='Save position of last committed chunk to file'
+                ),
+                make_option(
+                    '--resume',
+                    default=False,
+                    help='Continue parsing from position saved to --checkpoint file?'
+                ),
+                make_option(
+                    '--delta',
+                    default=None,
+                    help='Skip rows unchanged since previous import, which fingerprints are kept in this file'
+                ),
+                make_option(
+                    '--handler-threads',
+                    type='int',
+                    default=0,
+                    help='Call row()/sink() and field handlers in N threads'
+                ),
+                make_option(
+                    '--profile',
+                    default=False,
+                    help='Measure time and queries of reader, columns, handlers and commits?'
+                ),
+                make_option(
+                    '--format',
+                    default=None,
+                    help='Format of file (csv, tsv, xls, xlsx, jsonl, parquet), unless it\'s known by extension'
+                ),
             ]
 
     help = """
@@ -120,147 +273,641 @@ class BaseParser(with_metaclass(ParserMetaclass, BaseCommand)):
             default=False,
             help='Are you parsing Google Spreadsheet directly? Gspread required'
         )
+        parser.add_argument(
+            '--stream',
+            default=False,
+            help='Read csv file in a single pass? Progress is tracked by bytes read'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=0,
+            help='Commit every N rows in single transaction'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Parse chunks of rows in N processes'
+        )
+        parser.add_argument(
+            '--ordered',
+            default=True,
+            help='Merge results of workers in order of rows?'
+        )
+        parser.add_argument(
+            '--batch',
+            default=False,
+            help='Clean numeric and boolean columns of chunk of rows at once? (numpy required)'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=None,
+            help='Save position of last committed chunk to file'
+        )
+        parser.add_argument(
+            '--resume',
+            default=False,
+            help='Continue parsing from position saved to --checkpoint file?'
+        )
+        parser.add_argument(
+            '--delta',
+            default=None,
+            help='Skip rows unchanged since previous import, which fingerprints are kept in this file'
+        )
+        parser.add_argument(
+            '--handler-threads',
+            type=int,
+            default=0,
+            help='Call row()/sink() and field handlers in N threads'
+        )
+        parser.add_argument(
+            '--profile',
+            default=False,
+            help='Measure time and queries of reader, columns, handlers and commits?'
+        )
+        parser.add_argument(
+            '--format',
+            default=None,
+            help='Format of file (csv, tsv, xls, xlsx, jsonl, parquet), unless it\'s known by extension'
+        )
 
 
     def handle(self, *args, **options):
+        if self.is_old_django:
+            filename = args[0]
+        else:
+            filename = options.pop('input_file')
+        self.__set_options(options)
+        # Command only logs results, so they aren't collected
+        for _ in self.__parse(filename, collect_results=False):
+            pass
+
+    def parse(self, source, file_format=None, **options):
+        """
+        Parse rows of source without any output and yield RowResult of
+        every row as soon as it's known (rows returned by sink(values) are
+        known after flush). Source is path to file, file-like object of
+        given format (e.g. 'csv', 'xlsx' or 'jsonl') or iterable of rows.
+        Options are the same as of command, but passed as python values.
+        """
+        if file_format is not None:
+            options['format'] = file_format
+        defaults = self.__default_options()
+        unknown = set(options) - set(defaults)
+        if unknown:
+            raise TypeError('Unknown options: {}'.format(', '.join(sorted(unknown))))
+        defaults.update(options)
+        for key, value in defaults.items():
+            setattr(self, key, value)
+        return self.__parse(source, collect_results=True)
+
+    def __default_options(self):
+        parser = self.create_parser('', type(self).__name__)
+        if self.is_old_django:
+            return vars(parser.parse_args([])[0])
+        options = vars(parser.parse_args([]))
+        options.pop('input_file')
+        return options
+
+    def __parse(self, source, collect_results):
         self.start_time = time.time()
         self.parsed_successfully = 0
         self.parsed_unsuccessfully = 0
         self.skipped = 0
-        self.failed_rows = list()
+        self.skipped_unchanged = 0
+        self.upsert_counts = dict.fromkeys(UPSERT_COUNTERS, 0)
+        # Failed rows are collected in memory only by worker processes
+        self.failed_rows = None
         self.skipped_rows = list()
-        self.__set_options(options)
-        if self.is_old_django:
-            filename = args[0]
-        else:
-            filename = options['input_file']
-        self.__check_and_load_file(filename)
-        if self.is_csv:
-            self.parsed_object = open(self.filename, 'rb')
-        else:
-            self.__check_and_load_sheet()
-        print 'Parsing file....'
+        self.delta_store = None
+        self.file_checksum = None
+        self.results = deque() if collect_results else None
+        self.__compile_row_plan()
+        # Results are logged to stdout only by command
+        log_setup = None if collect_results else self.__setup_logging()
+        try:
+            for result in self.__parse_source(source):
+                yield result
+        finally:
+            if self.delta_store is not None:
+                self.delta_store.close()
+            if log_setup is not None:
+                log_handler, log_level = log_setup
+                logger.removeHandler(log_handler)
+                logger.setLevel(log_level)
+
+    def __parse_source(self, source):
+        self.__load_source(source)
+        self.__load_checkpoint()
+        if self.delta and not self.__open_delta_store():
+            logger.info('File is not changed since previous import, skipping it')
+            return
+        logger.info('Parsing file....')
         interim_data, total_rows = self.prepare_interim_data()
         if self.dryrun:
             transaction.set_autocommit(False)
-        self.parse_data(interim_data, total_rows)
-        self.after_parse_hook()
-        self.parse_statistics()
-        if self.dryrun:
-            transaction.rollback()
-            transaction.set_autocommit(True)
+        self.__open_failed_rows_file()
+        try:
+            for result in self.parse_data(interim_data, total_rows):
+                yield result
+            self.after_parse_hook()
+            self.parse_statistics()
+        finally:
+            if self.failed_rows_file is not None:
+                self.failed_rows_file.close()
+            if self.dryrun:
+                # Changes are rolled back even if parsing is stopped early
+                transaction.rollback()
+                transaction.set_autocommit(True)
+        if self.file_checksum is not None and not self.dryrun and not self.parsed_unsuccessfully:
+            # Failed rows are parsed again, even if file is the same
+            self.delta_store.set_checksum(self.file_checksum)
+
+    def __load_source(self, source):
+        self.is_rows = False
+        self.source_size = None
+        self.reader = None
+        self.compression = None
+        if isinstance(source, six.string_types):
+            self.__check_and_load_file(source)
+        elif hasattr(source, 'read'):
+            # Checkpoints and checksums are kept for files on disk only
+            self.filename = None
+            if self.format is None:
+                raise CommandError('Set format of file object')
+            # Format of compressed file object is given like 'csv.gz'
+            self.__open_with_reader(source, *split_compression(self.format))
+        else:
+            # Rows are taken as they are, without stripping of values
+            self.filename = None
+            self.is_csv = False
+            self.is_rows = True
+            self.parsed_object = source
+
+    def __open_with_reader(self, source, file_format, compression=None):
+        self.reader = get_reader(file_format)
+        self.is_csv = self.reader.kind == 'csv'
+        self.is_rows = self.reader.kind == 'rows'
+        if self.reader.kind != 'sheet' and self.sheet is not None:
+            raise CommandError('Can\'t parse sheet for {} file!'.format(file_format))
+        raw = source
+        if compression is not None:
+            if not getattr(self.reader, 'compressible', False):
+                raise CommandError('Compressed {} files are not supported'.format(file_format))
+            if isinstance(source, six.string_types):
+                raw = open(source, 'rb')
+            # Lines are decompressed while they are read, nothing is written to disk
+            source = DecompressingFile(raw, compression)
+            self.compression = compression
+        opened = self.reader.open(source, self)
+        if self.reader.kind == 'sheet':
+            self.work_book = opened
+            # Required to convert date cells
+            self.datemode = self.work_book.datemode
+            self.__check_and_load_sheet()
+            return
+        self.parsed_object = opened
+        if not self.is_csv:
+            return
+        # Size of compressed file is used for progress of compressed one
+        if self.filename is not None:
+            self.source_size = os.path.getsize(self.filename)
+            if compression is None:
+                return
+        else:
+            try:
+                self.source_size = os.fstat(raw.fileno()).st_size
+            except (AttributeError, EnvironmentError, ValueError):
+                pass
+        # File object (or decompressed stream) is read only once, as it can't be seeked
+        self.stream = True
 
     def after_parse_hook(self):
         pass
 
     def prepare_interim_data(self):
-        if self.is_csv:
+        if self.is_csv and self.checkpoint:
+            # Offsets of rows are tracked while file is read once, just like with --stream
+            self.stream = True
+        if self.is_csv and self.stream:
+            # Read csv file only once; progress is measured in bytes instead of rows
+            self.bytes_read = self.resume_offset
+            total_rows = self.source_size
+            if self.resume_offset:
+                self.parsed_object.seek(self.resume_offset)
+            object_generator = self.reader.reader(self.__count_bytes(self.parsed_object))
+            if self.header and not self.start_row:
+                next(object_generator)
+            if self.checkpoint:
+                object_generator = self.__track_offsets(object_generator)
+        elif self.is_csv:
             # Prepare progress bar data and generator for csv files
-            object_generator = csv.reader(self.parsed_object, quotechar='"', delimiter=',')
+            object_generator = self.reader.reader(self.parsed_object)
             total_rows = sum(1 for line in object_generator)
             if self.header:
                 self.parsed_object.seek(0)
-                object_generator = csv.reader(self.parsed_object, quotechar='"', delimiter=',')
+                object_generator = self.reader.reader(self.parsed_object)
                 total_rows -= 1
                 next(object_generator)
+        elif self.is_rows:
+            # Amount of rows is known for sequences only
+            total_rows = len(self.parsed_object) if hasattr(self.parsed_object, '__len__') else None
+            object_generator = iter(self.parsed_object)
+            # Readers of e.g. JSON Lines don't have header
+            if self.header and getattr(self.reader, 'has_header', True):
+                next(object_generator, None)
+                if total_rows:
+                    total_rows -= 1
         else:
             # Prepare progress bar data and generator for non-csv files
-            row_offset = 1 if self.header else 0
+            self.row_offset = 1 if self.header else 0
+            # Resumed sheet is read from the first uncommitted row
             if self.google_spreadsheet:
                 total_rows = self.parsed_object.row_count
-                object_generator = self.__get_iterator_for_gsheet(offset=row_offset)
+                object_generator = self.__get_iterator_for_gsheet(offset=self.row_offset + self.start_row)
             else:
                 total_rows = self.parsed_object.nrows
-                object_generator = self.__get_iterator_for_xls(offset=row_offset)
+                object_generator = self.__get_iterator_for_xls(offset=self.row_offset + self.start_row)
             total_rows -= 1
         return object_generator, total_rows
 
     def parse_data(self, object_generator, total_rows):
+        """
+        Parse enumerated rows; yields RowResult of every row, if results
+        are collected (see parse), and nothing otherwise.
+        """
+        self.pbar = None
         if self.progress:
-            pbar = self.__initialize_progress_bar(total_rows)
-        for index, raw_row in enumerate(object_generator):
-            if len(raw_row) != len(self.fields):
-                raise CommandError('Incorrect parsed file! Stopping parsing! {} != {}'.format(len(raw_row),len(self.fields)))
-            if self.is_csv:
-                row = map(lambda s: s.strip(), raw_row)
-            else:
-                row = raw_row
-            # TODO: invent great way to ignore last row when there is header
-            if self.header and not self.is_csv and index == total_rows:
-                continue
-            self.process_row(row, index)
-            if self.progress:
-                pbar.update(index + 1)
+            self.pbar = self.__initialize_progress_bar(total_rows)
+        self.sink_buffer = []
+        self.sink_size = 0
+        self.failures_seen = 0
+        self.last_summary_time = time.time()
+        self.delta_pending = OrderedDict()
+        self.handler_pool = None
+        if self.handler_threads and self.workers <= 1:
+            # Workers start their own threads
+            self.__start_handler_pool()
+        try:
+            if self.profiler is None:
+                for result in self.__collect_results(self.__parse_rows(enumerate(object_generator, self.start_row), total_rows)):
+                    yield result
+                return
+            self.profiler.install(connections[DEFAULT_DB_ALIAS])
+            try:
+                rows = enumerate(self.profiler.iterate('reader', object_generator), self.start_row)
+                for result in self.__collect_results(self.__parse_rows(rows, total_rows)):
+                    yield result
+            finally:
+                self.profiler.uninstall()
+        finally:
+            self.__stop_handler_pool()
+
+    def __collect_results(self, steps):
+        # Results are yielded between rows (or chunks), while nothing is being parsed
+        results = self.results
+        for _ in steps:
+            while results:
+                yield results.popleft()
+        while results:
+            yield results.popleft()
+
+    def __emit(self, row_number, status, message, row):
+        if self.results is not None:
+            self.results.append(RowResult(row_number, status, message, row))
+
+    def __parse_rows(self, rows, total_rows):
+        if self.workers > 1:
+            # Chunks are prefetched and cleaned by workers themselves
+            for step in self.__parse_in_workers(rows, total_rows):
+                yield step
+            return
+        if self.batch_columns:
+            rows = self.__clean_batches(rows)
+        if self.chunk_size:
+            for chunk in self.__chunks(rows, self.chunk_size):
+                self.__prefetch(chunk)
+                self.__parse_chunk(chunk, total_rows)
+                yield
+        else:
+            if self.prefetch_columns:
+                rows = self.__prefetch_chunks(rows)
+            try:
+                for item in rows:
+                    self.__parse_row(total_rows, *item)
+                    yield
+                    # Every row is committed already, unless it's waiting in sink
+                    if len(self.delta_pending) >= self.delta_batch_size and not self.sink_buffer:
+                        self.__save_fingerprints()
+            finally:
+                self.__complete_pending_rows()
+                self.flush_sink()
+                self.__save_fingerprints()
 
-    def process_row(self, row, row_number):
+    def parse_chunk(self, chunk, total_rows):
+        """
+        Parse chunk of enumerated rows inside of worker process.
+        Returns counters to be merged by parent process.
+        """
+        self.parsed_successfully = 0
+        self.parsed_unsuccessfully = 0
+        self.skipped = 0
+        self.skipped_unchanged = 0
+        self.upsert_counts = dict.fromkeys(UPSERT_COUNTERS, 0)
+        self.failed_rows = list()
+        if self.results is not None:
+            self.results = deque()
+        self.failures_seen = 0
+        self.pbar = None
+        self.__reset_column_statistics()
+        self.delta_pending = OrderedDict()
+        if self.handler_threads and self.handler_pool is None:
+            # Threads of worker are kept till worker exits
+            self.__start_handler_pool()
+        self.__prefetch(chunk)
+        rows = iter(chunk)
+        if self.batch_columns:
+            rows = self.__clean_batches(rows)
+        if self.profiler is None:
+            self.__parse_chunk(rows, total_rows)
+        else:
+            self.profiler.reset()
+            self.profiler.install(connections[DEFAULT_DB_ALIAS])
+            try:
+                self.__parse_chunk(rows, total_rows)
+            finally:
+                self.profiler.uninstall()
+        return {
+            'rows': len(chunk),
+            'parsed_successfully': self.parsed_successfully,
+            'parsed_unsuccessfully': self.parsed_unsuccessfully,
+            'skipped': self.skipped,
+            'skipped_unchanged': self.skipped_unchanged,
+            'upsert_counts': self.upsert_counts,
+            'failed_rows': self.failed_rows,
+            'results': list(self.results) if self.results is not None else None,
+            # Fingerprints are saved by parent process only
+            'fingerprints': list(self.delta_pending.values()),
+            'column_statistics': [column.statistics for column in self.statistic_columns],
+            'profile': self.profiler.snapshot() if self.profiler is not None else None,
+        }
+
+    def __parse_in_workers(self, rows, total_rows):
+        global _worker_parser
+        # Workers are forked with copy of this parser, so there is nothing to pickle except rows
+        _worker_parser = self
+        pool = multiprocessing.Pool(self.workers, initializer=_init_worker)
+        pending = deque()
+        processed = 0
+        try:
+            for chunk in self.__chunks(rows, self.chunk_size or self.worker_chunk_size):
+                pending.append(pool.apply_async(_parse_chunk_in_worker, (chunk, total_rows)))
+                # Don't read file further than workers are able to process
+                if len(pending) >= self.workers * 2:
+                    processed += self.__merge_worker_result(pending)
+                    self.__update_progress(processed)
+                    yield
+            while pending:
+                processed += self.__merge_worker_result(pending)
+                self.__update_progress(processed)
+                yield
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _worker_parser = None
+
+    def __merge_worker_result(self, pending):
+        result = pending[0]
+        if not self.ordered:
+            while not any(item.ready() for item in pending):
+                pending[0].wait(0.05)
+            result = next(item for item in pending if item.ready())
+        pending.remove(result)
+        counters = result.get()
+        self.parsed_successfully += counters['parsed_successfully']
+        self.parsed_unsuccessfully += counters['parsed_unsuccessfully']
+        self.skipped += counters['skipped']
+        self.skipped_unchanged += counters['skipped_unchanged']
+        self.__count_upserted(counters['upsert_counts'])
+        for failed_row in counters['failed_rows']:
+            self.__save_failed_row(failed_row)
+        if self.results is not None:
+            self.results.extend(counters['results'])
+        if self.delta_store is not None and not self.dryrun:
+            self.delta_store.save(counters['fingerprints'])
+        for column, statistics in zip(self.statistic_columns, counters['column_statistics']):
+            for key, value in statistics.items():
+                column.statistics[key] += value
+        if counters['profile'] is not None:
+            self.profiler.merge(counters['profile'])
+        return counters['rows']
+
+    def __chunks(self, rows, size):
+        while True:
+            chunk = list(islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def __parse_chunk(self, chunk, total_rows):
+        # Every chunk of rows is written in single transaction instead of transaction per row
+        error = None
+        last_index = None
+        with transaction.atomic():
+            for item in chunk:
+                try:
+                    self.__parse_row(total_rows, *item)
+                except Exception:
+                    # Rows, processed before error, are committed just like in autocommit mode
+                    error = sys.exc_info()
+                    break
+                last_index = item[0]
+            self.__complete_pending_rows()
+            self.flush_sink()
+            if self.dryrun and self.workers > 1:
+                # Worker has its own connection, which isn't rolled back by parent
+                transaction.set_rollback(True)
+        if self.workers <= 1:
+            self.__save_fingerprints()
+        if self.checkpoint and not self.dryrun and last_index is not None:
+            # Saved only after commit, so resumed parsing never repeats committed rows
+            self.__save_checkpoint(last_index)
+        if error is not None:
+            six.reraise(*error)
+
+    def __parse_row(self, total_rows, index, raw_row, cleaned=None):
+        if len(raw_row) != len(self.fields):
+            raise CommandError('Incorrect parsed file! Stopping parsing! {} != {}'.format(len(raw_row),len(self.fields)))
         if self.is_csv:
-            row_raw_values = [cell for cell in row]
+            row = map(lambda s: s.strip(), raw_row)
         else:
-            row_raw_values = [cell.value for cell in row]
-        if not any(row_raw_values):
-            print "Blank line, SKIP"
-            return None
+            row = raw_row
+        # TODO: invent great way to ignore last row when there is header
+        if self.header and not self.is_csv and index == total_rows:
+            return
+        self.process_row(row, index, cleaned)
+        self.__update_progress(index + 1)
 
-        row_values = []
-        row_errors = []
-        row_values = dict()
-        row_preparation = dict()
-        for index, cell in enumerate(row):
+    def __update_progress(self, processed):
+        if self.pbar is not None:
+            self.pbar.update(self.bytes_read if self.is_csv and self.stream else processed)
+        now = time.time()
+        if now - self.last_summary_time >= self.summary_interval:
+            self.last_summary_time = now
+            logger.info('Processed %s rows: %s parsed, %s failed, %s skipped',
+                        processed, self.parsed_successfully, self.parsed_unsuccessfully, self.skipped)
 
-            option = self.fields.values()[index]
-            if isinstance(option, EmptyColumn):
-                continue
-            if self.is_csv:
-                value = cell
-            else:
-                value = cell.value
-            row_preparation[option] = value
+    def process_row(self, row, row_number, cleaned=None):
+        if not any(row):
+            logger.debug('Blank line %s, SKIP', row_number)
+            return None
+
+        delta = None
+        if self.delta_store is not None:
+            delta = (row[self.delta_key_position], fingerprint(row))
+            if self.delta_store.is_unchanged(*delta):
+                self.skipped_unchanged += 1
+                logger.debug('Row %s is unchanged, SKIP', row_number)
+                self.__emit(row_number, 'Skipped', 'Row {} is unchanged'.format(row_number), row)
+                return None
 
         # Check status column first-hand. Just in case, not to parse broken & marked lines
-        status_keys = filter(lambda x: isinstance(x, StatusColumn), row_preparation.keys())
-        for item in status_keys:
-            check_value = row_preparation[item]
-            if not item.normalize(check_value):
+        for position, column in self.status_plan:
+            if not column.normalize(row[position]):
                 return self.skip('Row {} skipped due to status column'.format(row_number))
 
         # Parse everything required
-        for option, value in row_preparation.items():
-            errors = option.validate(value)
-            if errors:
-                if self.is_csv:
-                    coordinates = index
-                elif self.google_spreadsheet:
-                    coordinates = (cell.row, cell.col)
+        row_errors = []
+        row_values = dict()
+        # With --handler-threads field handlers are called in thread along with row()
+        deferred_handlers = [] if self.handler_pool is not None else None
+        cell_types = getattr(row, 'types', None)
+        for position, column, handler in self.row_plan:
+            if cleaned is not None and column in cleaned:
+                value, invalid = cleaned[column]
+                if invalid:
+                    # Invalid cells get their errors from scalar path
+                    value, errors = column.clean(row[position])
                 else:
-                    coordinates = cell.coordinate
+                    errors = None
+            elif cell_types is not None and column in self.cell_type_columns:
+                value, errors = column.clean_cell(row[position], cell_types[position], self.datemode)
+            else:
+                value, errors = column.clean(row[position])
+            if errors:
+                coordinates = self.__get_coordinates(row_number, position)
                 if self.failfast:
                     raise CommandError('Errors in cell {}: {}'.format(coordinates, errors))
                 else:
                     row_errors.append({coordinates: errors})
                 continue
-            value = option.normalize(value)
 
             # If handler is defined, it should be activated
-            if hasattr(self, '{}_handler'.format(option.title)):
-                handler = getattr(self, '{}_handler'.format(option.title))
-                value = handler(value)
-            row_values[option.title] = value
+            if handler is not None:
+                if deferred_handlers is None:
+                    value = handler(value)
+                else:
+                    deferred_handlers.append((column.title, handler))
+            row_values[column.title] = value
 
+        # Row is still handled, but its result tells about invalid cells
+        message = None
         if row_errors:
-            print "=" * 80
-            print row_errors
-            print "=" * 80
-        if hasattr(self, 'row'):
-            row_handler = getattr(self, 'row')
+            message = 'Errors in row {}: {}'.format(row_number, row_errors)
+            self.__log_failure('%s', message)
+        if self.row_handler is None:
+            raise CommandError('Row processing command must be specified')
+        if deferred_handlers is not None:
+            self.__dispatch_row(row_values, deferred_handlers, row, row_number, delta, message)
+            return
+        res = error = None
+        try:
+            res = self.__call_row_handler(row_values)
+        except BaseException, e:
+            error = e
+        self.__complete_row(res, error, row, row_number, delta, message)
+
+    def __call_row_handler(self, row_values):
+        if (self.chunk_size or self.workers > 1) and not self.is_sink:
+            # Row is parsed inside of chunk transaction (workers always use one);
+            # savepoint isolates failed row, so the rest of chunk is still committed.
+            # sink(values) only returns objects, failed ones are found by flush_sink
+            with transaction.atomic():
+                return self.row_handler(row_values)
+        return self.row_handler(row_values)
+
+    def __complete_row(self, res, error, row, row_number, delta, message=None):
+        if error is None:
             try:
-                res = row_handler(row_values)
-                if res is None:
-                    res = self.success('Row {} parsed successfully'.format(row_number))
+                if delta is not None:
+                    # Fingerprint is saved once row is committed, unless row fails
+                    self.delta_pending[row_number] = delta
+                if self.is_sink and self.__add_to_sink(res, row, row_number, message):
+                    # Result will be known after objects are flushed
+                    return
             except BaseException, e:
-                res = self.failure('Error during parsing row {}: {}'.format(row_number, e), row)
-            self.__process_result(res)
-        else:
-            raise CommandError('Row processing command must be specified')
+                error = e
+        if error is not None:
+            res = self.failure('Error during parsing row {}: {}'.format(row_number, error), row, row_number)
+        elif res is None:
+            # Message is formatted only if debug logging is enabled
+            self.parsed_successfully += 1
+            logger.debug('Row %s parsed successfully', row_number)
+            self.__emit(row_number, 'Success', message, row)
+            return
+        self.__process_result(res, row, row_number)
+
+    def __start_handler_pool(self):
+        self.handler_pool = ThreadPool(self.handler_threads)
+        self.handler_pending = deque()
+
+    def __stop_handler_pool(self):
+        if self.handler_pool is None:
+            return
+        # Connections are opened by every thread and can be closed only by it
+        closing = _ThreadBarrier(self.handler_threads)
+        self.handler_pool.map(closing.close_connections, range(self.handler_threads), chunksize=1)
+        self.handler_pool.close()
+        self.handler_pool.join()
+        self.handler_pool = None
+
+    def __dispatch_row(self, row_values, handlers, row, row_number, delta, message):
+        result = self.handler_pool.apply_async(self.__handle_row_in_thread, (row_values, handlers))
+        self.handler_pending.append((result, row, row_number, delta, message))
+        # Don't clean rows further than threads are able to handle
+        if len(self.handler_pending) >= self.handler_threads * 2:
+            self.__complete_pending_row()
+
+    def __handle_row_in_thread(self, row_values, handlers):
+        # Returns result of row handler, its error and error of field handler
+        try:
+            for title, handler in handlers:
+                row_values[title] = handler(row_values[title])
+        except Exception:
+            return None, None, sys.exc_info()
+        try:
+            return self.__call_row_handler(row_values), None, None
+        except BaseException, e:
+            return None, e, None
+
+    def __complete_pending_row(self):
+        # Results are accounted in order of rows
+        result, row, row_number, delta, message = self.handler_pending.popleft()
+        res, error, handler_error = result.get()
+        if handler_error is not None:
+            # Just like without threads, error of field handler stops parsing
+            six.reraise(*handler_error)
+        self.__complete_row(res, error, row, row_number, delta, message)
+
+    def __complete_pending_rows(self):
+        if self.handler_pool is None:
+            return
+        while self.handler_pending:
+            self.__complete_pending_row()
 
     def success(self, message):
         result_dict = {
@@ -269,11 +916,12 @@ class BaseParser(with_metaclass(ParserMetaclass, BaseCommand)):
         }
         return result_dict
 
-    def failure(self, message, row):
+    def failure(self, message, row, row_number=None):
         result_dict = {
             'status': 'Failure',
             'message': message,
             'row': row,
+            'row_number': row_number,
         }
         return result_dict
 
@@ -284,50 +932,392 @@ class BaseParser(with_metaclass(ParserMetaclass, BaseCommand)):
         }
         return result_dict
 
+    def flush_sink(self):
+        """
+        Insert (or upsert by upsert_keys) objects returned by sink(values)
+        in bulk. On database error rows are saved one by one to find failed ones.
+        """
+        buffer = self.sink_buffer
+        if not buffer:
+            return
+        self.sink_buffer = []
+        self.sink_size = 0
+        try:
+            with transaction.atomic():
+                counts = self.__save_objects((item for _, _, objects, _ in buffer for item in objects),
+                                             batch_size=self.sink_batch_size)
+        except Exception:
+            for row_number, row, objects, message in buffer:
+                try:
+                    with transaction.atomic():
+                        counts = self.__save_objects(objects)
+                except Exception, e:
+                    self.__process_result(
+                        self.failure('Error during saving row {}: {}'.format(row_number, e), row, row_number)
+                    )
+                else:
+                    self.__count_upserted(counts)
+                    self.parsed_successfully += 1
+                    logger.debug('Row %s parsed successfully', row_number)
+                    self.__emit(row_number, 'Success', message, row)
+        else:
+            self.__count_upserted(counts)
+            self.parsed_successfully += len(buffer)
+            if logger.isEnabledFor(logging.DEBUG):
+                for row_number, _, _, _ in buffer:
+                    logger.debug('Row %s parsed successfully', row_number)
+            if self.results is not None:
+                for row_number, row, _, message in buffer:
+                    self.__emit(row_number, 'Success', message, row)
+
+    def __save_objects(self, items, batch_size=None):
+        # Counts are returned only after transaction succeeds, so rolled back batches aren't counted
+        if not self.upsert_keys:
+            bulk_insert((obj for obj, _ in items), batch_size=batch_size)
+            return None
+        # Objects are upserted separately by sets of their given fields
+        groups = OrderedDict()
+        for obj, fields in items:
+            groups.setdefault(fields, []).append(obj)
+        counts = dict.fromkeys(UPSERT_COUNTERS, 0)
+        for fields, objects in groups.items():
+            for counter, value in bulk_upsert(objects, self.upsert_keys, batch_size=batch_size, fields=fields).items():
+                counts[counter] += value
+        return counts
+
+    def __count_upserted(self, counts):
+        if counts:
+            for counter, value in counts.items():
+                self.upsert_counts[counter] += value
+
     def parse_statistics(self):
         time_spent = time.time() - self.start_time
         result_string = 'Done!\nSuccessfully parsed {} items.\nFailed to parse {} items.\nSkipped {} items.\nTime spent:{}'.format(
             self.parsed_successfully, self.parsed_unsuccessfully, self.skipped, time_spent)
-        print result_string
+        if self.delta:
+            result_string += '\nSkipped {} unchanged items.'.format(self.skipped_unchanged)
+        if self.upsert_keys:
+            result_string += '\nInserted {inserted} items, updated {updated} items, {unchanged} items unchanged.'.format(
+                **self.upsert_counts)
+        if self.profiler is not None:
+            result_string += '\nProfile (slowest first):\n' + '\n'.join(
+                '  ' + line for line in self.profiler.report()
+            )
+        for column in self.statistic_columns:
+            result_string += '\nColumn {}: {}'.format(column.title, ', '.join(
+                '{} {}'.format(key.replace('_', ' '), value) for key, value in sorted(column.statistics.items())
+            ))
+        logger.info(result_string)
         if self.savestats:
-            output_file_name = 'parse_statistics_' + timezone.now().strftime("%Y%m%d-%H%m") + '.txt'
-            failed_csv_output_file = 'failed_rows_' + timezone.now().strftime("%Y%m%d-%H%m") + '.csv'
-            result_string += '\n Failed rows saved to {}'.format(failed_csv_output_file)
-            print 'Saving extended statistics to file: {}'.format(output_file_name)
+            output_file_name = 'parse_statistics_' + self.stats_timestamp + '.txt'
+            result_string += '\n Failed rows saved to {}'.format(self.failed_rows_file.name)
+            logger.info('Saving extended statistics to file: %s', output_file_name)
             f = open(output_file_name, 'w')
             f.write(result_string)
             f.close()
-            with open(failed_csv_output_file, 'wb') as csv_output:
-                writer = UnicodeWriter(csv_output, quotechar='"', delimiter=';')
-                output_file_name.write('Next rows failed to be parsed\n')
-                for r in self.failed_rows:
-                    try:
-                        for i in xrange(len(r)):  # cleaner way "for x in r" fails to work
-                            r[i] = r[i].decode('UTF-8')
-                        writer.writerow(r)
-                    except BaseException as e:
-                        print e
-                        print r
+
+    def __compile_row_plan(self):
+        # Resolve everything, that doesn't depend on row contents, only once per parsing
+        row_plan = []
+        for position, column in enumerate(self.fields.values()):
+            if isinstance(column, EmptyColumn):
+                continue
+            handler = getattr(self, '{}_handler'.format(column.title), None)
+            row_plan.append((position, column, handler))
+        self.row_plan = tuple(row_plan)
+        self.status_plan = tuple((position, column) for position, column, _ in self.row_plan
+                                 if isinstance(column, StatusColumn))
+        self.prefetch_columns = tuple((position, column) for position, column, _ in self.row_plan
+                                      if isinstance(column, ModelColumn) and column.prefetch)
+        # Columns, which handle spreadsheet cell types themselves
+        self.cell_type_columns = frozenset(
+            column for _, column, _ in self.row_plan
+            if column.clean_cell.__func__ is not BaseColumn.clean_cell.__func__
+        )
+        # Columns, which are cleaned column-wise for chunk of rows
+        self.batch_columns = ()
+        if self.batch:
+            self.batch_columns = tuple(
+                (position, column) for position, column, _ in self.row_plan
+                if column.clean_batch.__func__ is not BaseColumn.clean_batch.__func__ and
+                column not in self.cell_type_columns
+            )
+        if self.batch_columns:
+            try:
+                import numpy
+            except ImportError:
+                raise CommandError('No numpy package found! Please, install it to clean columns in batches')
+        # Columns, which collect their own statistics (e.g. cache usage)
+        self.statistic_columns = tuple(column for _, column, _ in self.row_plan if getattr(column, 'statistics', None))
+        self.__reset_column_statistics()
+        self.is_sink = hasattr(self, 'sink')
+        self.row_handler = getattr(self, 'sink', None) or getattr(self, 'row', None)
+        if self.handler_threads and self.dryrun and not self.is_sink:
+            # Threads use their own database connections
+            raise CommandError('Changes made by row() in handler threads can\'t be rolled back by --dryrun')
+        if self.upsert_keys:
+            if not self.is_sink:
+                raise CommandError('Define sink(values) to upsert objects returned by it')
+            if self.sink_model is not None:
+                # Misconfigured keys would fail every row at flush
+                try:
+                    upsert_key_fields(self.sink_model, self.upsert_keys)
+                except ValueError, e:
+                    raise CommandError('Wrong upsert_keys: {}'.format(e))
+                try:
+                    for name in self.upsert_fields or ():
+                        self.sink_model._meta.get_field(name)
+                except FieldDoesNotExist, e:
+                    raise CommandError('Wrong upsert_fields: {}'.format(e))
+        # Profiled flush of previous parsing is replaced
+        vars(self).pop('flush_sink', None)
+        if self.delta:
+            if self.delta_key not in self.fields:
+                raise CommandError('Set delta_key to title of column, which identifies rows between imports')
+            self.delta_key_position = list(self.fields).index(self.delta_key)
+        self.profiler = None
+        if self.profile:
+            self.__profile_row_plan()
+
+    def __profile_row_plan(self):
+        # Measured functions are swapped in once, so parsing without --profile isn't slowed down
+        profiler = self.profiler = Profiler()
+        proxies = dict((column, ProfiledColumn(column, profiler)) for _, column, _ in self.row_plan)
+        self.row_plan = tuple(
+            (position, proxies[column], handler and profiler.wrap('handler {}'.format(handler.__name__), handler))
+            for position, column, handler in self.row_plan
+        )
+        self.prefetch_columns = tuple((position, proxies[column]) for position, column in self.prefetch_columns)
+        self.batch_columns = tuple((position, proxies[column]) for position, column in self.batch_columns)
+        self.cell_type_columns = frozenset(proxies[column] for column in self.cell_type_columns)
+        if self.row_handler is not None:
+            self.row_handler = profiler.wrap('{}()'.format(self.row_handler.__name__), self.row_handler)
+        self.flush_sink = profiler.wrap('sink flush', type(self).flush_sink.__get__(self, type(self)))
+
+    def __reset_column_statistics(self):
+        for column in self.statistic_columns:
+            column.statistics = dict.fromkeys(column.statistics, 0)
+
+    def __setup_logging(self):
+        # Output goes to stdout of command, unless logging of package is configured in settings;
+        # returns handler and previous level of logger to be restored after parsing
+        if any(not isinstance(handler, logging.NullHandler) for handler in logger.handlers):
+            return None
+        handler = logging.StreamHandler(self.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        previous_level = logger.level
+        logger.setLevel(LOG_LEVELS.get(int(self.verbosity), logging.DEBUG))
+        logger.addHandler(handler)
+        return handler, previous_level
+
+    def __log_failure(self, message, *args):
+        # Sample failures, so broken file doesn't flood the log
+        self.failures_seen += 1
+        if int(self.verbosity) >= 2 or self.failures_seen <= self.failure_log_limit:
+            failure_logger.warning(message, *args)
+            return
+        if self.failures_seen == self.failure_log_limit + 1:
+            failure_logger.warning('Too many failures, only one of every %s is logged', self.failure_log_every)
+        if self.failures_seen % self.failure_log_every == 0:
+            failure_logger.warning(message, *args)
+
+    def __open_failed_rows_file(self):
+        # Failed rows are written as soon as they fail, so they are never kept in memory
+        self.stats_timestamp = timezone.now().strftime("%Y%m%d-%H%m")
+        self.failed_rows_file = None
+        self.failed_rows_writer = None
+        if self.savestats:
+            self.failed_rows_file = open('failed_rows_' + self.stats_timestamp + '.csv', 'wb', 1 << 16)
+            self.failed_rows_writer = UnicodeWriter(self.failed_rows_file, quotechar='"', delimiter=';')
+            self.failed_rows_writer.writerow(['Row', 'Error'] + list(self.fields))
+
+    def __save_failed_row(self, failed_row):
+        if self.failed_rows is not None:
+            self.failed_rows.append(failed_row)
+        elif self.failed_rows_writer is not None:
+            self.failed_rows_writer.writerow(failed_row)
+
+    def __get_coordinates(self, row_number, position):
+        if self.is_csv or self.is_rows:
+            return position
+        rowx = row_number + self.row_offset
+        if self.google_spreadsheet:
+            return (rowx + 1, position + 1)
+        else:
+            return cellname(rowx, position)
+
+    def __add_to_sink(self, objects, row, row_number, message=None):
+        if objects is None:
+            return False
+        if not isinstance(objects, (list, tuple)):
+            objects = [objects]
+        instances = []
+        upsert_fields = frozenset(self.upsert_fields) if self.upsert_fields is not None else None
+        for obj in objects:
+            # Objects are kept with names of fields, which are updated by upsert
+            fields = upsert_fields
+            if isinstance(obj, dict):
+                if self.sink_model is None:
+                    raise CommandError('Set sink_model to return dicts from sink(values)')
+                if fields is None:
+                    fields = frozenset(obj)
+                obj = self.sink_model(**obj)
+            instances.append((obj, fields))
+        self.sink_buffer.append((row_number, row, instances, message))
+        self.sink_size += len(instances)
+        if self.sink_size >= self.sink_batch_size:
+            self.flush_sink()
+        return True
+
+    def __prefetch_chunks(self, rows):
+        # Rows are taken one by one after their chunk is prefetched, so nothing reads ahead of cache
+        for chunk in self.__chunks(rows, self.prefetch_chunk_size):
+            self.__prefetch(chunk)
+            for item in chunk:
+                yield item
+
+    def __prefetch(self, chunk):
+        # Resolve model lookups of chunk of rows with one query per column (and prefetch_chunk_size values);
+        # cache of column is replaced, so chunk must be parsed before the next one is prefetched
+        for position, column in self.prefetch_columns:
+            values = [item[1][position] for item in chunk if len(item[1]) > position]
+            if self.is_csv:
+                values = [value.strip() for value in values]
+            column.prefetch_objects(values, batch_size=self.prefetch_chunk_size)
+
+    def __load_checkpoint(self):
+        self.start_row = 0
+        self.resume_offset = 0
+        if not self.checkpoint:
+            if self.resume:
+                raise CommandError('Set --checkpoint file to resume parsing from')
+            return
+        if not self.chunk_size:
+            raise CommandError('Checkpoints are saved for committed chunks only, set --chunk-size')
+        if self.filename is None:
+            raise CommandError('Checkpoints are saved for files only')
+        if self.compression is not None:
+            raise CommandError('Checkpoints can\'t be saved for compressed files, as they can\'t be seeked')
+        if self.workers > 1:
+            raise CommandError('Checkpoints can\'t be saved while chunks are committed by --workers')
+        self.row_offsets = deque()
+        if not self.resume or not os.path.exists(self.checkpoint):
+            self.offsets_start = 0
+            return
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        if state['filename'] != self.filename or state['sheet'] != self.sheet:
+            raise CommandError('Checkpoint {} is saved for another file'.format(self.checkpoint))
+        self.start_row = self.offsets_start = state['row'] + 1
+        self.resume_offset = state['offset'] or 0
+        self.parsed_successfully = state['parsed_successfully']
+        self.parsed_unsuccessfully = state['parsed_unsuccessfully']
+        self.skipped = state['skipped']
+        self.skipped_unchanged = state.get('skipped_unchanged', 0)
+        self.upsert_counts.update(state.get('upsert_counts', {}))
+        logger.info('Resuming from row %s', self.start_row)
+
+    def __save_checkpoint(self, last_index):
+        offset = None
+        if self.is_csv:
+            # Offsets of rows read ahead (e.g. by prefetch) are kept till their chunk is committed
+            while self.offsets_start <= last_index:
+                offset = self.row_offsets.popleft()
+                self.offsets_start += 1
+        state = {
+            'filename': self.filename,
+            'sheet': self.sheet,
+            'row': last_index,
+            'offset': offset,
+            'parsed_successfully': self.parsed_successfully,
+            'parsed_unsuccessfully': self.parsed_unsuccessfully,
+            'skipped': self.skipped,
+            'skipped_unchanged': self.skipped_unchanged,
+            'upsert_counts': self.upsert_counts,
+        }
+        # File is replaced at once, so it's never left half-written
+        temp_name = self.checkpoint + '.tmp'
+        with open(temp_name, 'w') as f:
+            json.dump(state, f)
+        os.rename(temp_name, self.checkpoint)
+
+    def __open_delta_store(self):
+        # Returns False, if file is the same as imported last time
+        source = '{}.{}'.format(type(self).__module__, type(self).__name__)
+        self.delta_store = FingerprintStore(self.delta, source)
+        if self.google_spreadsheet or self.filename is None:
+            return True
+        self.file_checksum = file_checksum(self.filename)
+        return self.delta_store.get_checksum() != self.file_checksum
+
+    def __save_fingerprints(self):
+        if self.delta_store is None or not self.delta_pending:
+            return
+        if not self.dryrun:
+            self.delta_store.save(self.delta_pending.values())
+        self.delta_pending.clear()
+
+    def __track_offsets(self, rows):
+        # Byte offset of every row end, to seek there on resume
+        for row in rows:
+            self.row_offsets.append(self.bytes_read)
+            yield row
+
+    def __clean_batches(self, rows):
+        # Clean chunk of rows column-wise; every row is yielded with its own cleaned values,
+        # as rows can be parsed after the next chunk is cleaned (e.g. in larger --chunk-size)
+        for chunk in self.__chunks(rows, self.batch_chunk_size):
+            cleaned = [dict() for _ in chunk]
+            for position, column in self.batch_columns:
+                values = [raw_row[position] if len(raw_row) > position else u'' for _, raw_row in chunk]
+                if self.is_csv:
+                    values = [value.strip() for value in values]
+                values, invalid = column.clean_batch(values)
+                for row_cleaned, value, is_invalid in zip(cleaned, values, invalid):
+                    row_cleaned[column] = (value, is_invalid)
+            for (index, raw_row), row_cleaned in zip(chunk, cleaned):
+                yield index, raw_row, row_cleaned
+
+    def __count_bytes(self, lines):
+        if self.compression is not None:
+            # Progress of compressed file is measured in compressed bytes
+            source = self.parsed_object
+            for line in lines:
+                self.bytes_read = source.compressed_read
+                yield line
+            return
+        for line in lines:
+            self.bytes_read += len(line)
+            yield line
 
     def __get_iterator_for_gsheet(self, offset):
-        parsed_object = self.parsed_object
-        min_row = offset + 1
-        max_row = parsed_object.col_values(1).index('') +1 
-        max_col = parsed_object.row_values(1).index('') + 1
-        min_col = 1
-        for row in range(min_row, max_row):
-            yield tuple(parsed_object.cell(row, column)
-                        for column in range(min_col, max_col))
+        worksheet = self.parsed_object
+        # Sheet is parsed till first empty cell in first row and first column
+        first_row = worksheet.row_values(1)
+        ncols = first_row.index('') if '' in first_row else len(first_row)
+        if not ncols:
+            return
+        row = offset + 1
+        while row <= worksheet.row_count:
+            # Whole page of rows is fetched with single request
+            last_row = min(row + self.gsheet_page_size - 1, worksheet.row_count)
+            cells = worksheet.range('{}:{}'.format(cellname(row - 1, 0), cellname(last_row - 1, ncols - 1)))
+            for start in range(0, len(cells), ncols):
+                values = tuple(cell.value for cell in cells[start:start + ncols])
+                if values[0] == '':
+                    return
+                yield values
+            row = last_row + 1
 
     def __get_iterator_for_xls(self, offset):
-        parsed_object = self.parsed_object
-        min_row = offset
-        max_row = parsed_object.nrows
-        max_col = parsed_object.ncols
-        min_col = 0
-        for row in range(min_row, max_row):
-            yield tuple(parsed_object.cell(row, column)
-                        for column in range(min_col, max_col))
+        sheet = self.parsed_object
+        if hasattr(sheet, 'get_raw_rows'):
+            # Streamed .xlsx sheet
+            rows = islice(sheet.get_raw_rows(), offset, None)
+        else:
+            rows = ((sheet.row_values(rowx), sheet.row_types(rowx)) for rowx in xrange(offset, sheet.nrows))
+        for values, types in rows:
+            yield SheetRow(values, types)
 
     def __set_options(self, options):
         for key, value in options.items():
@@ -356,22 +1346,19 @@ class BaseParser(with_metaclass(ParserMetaclass, BaseCommand)):
                 raise CommandError('Please set credential object in settings')
             gs = gspread.authorize(credentials)
             self.work_book = gs.open(filename)
+            self.filename = filename
             self.is_csv = False
+            self.__check_and_load_sheet()
         else:
             self.filename = os.path.abspath(filename)
-            name, extension = os.path.splitext(filename)
-            if extension == '.csv':
-                self.is_csv = True
-            else:
-                self.is_csv = False
             if not os.path.exists(self.filename):
                 raise CommandError('Can\'t find given file: {}'.format(self.filename))
-            if self.is_csv and self.sheet is not None:
-                raise CommandError('Can\'t parse sheet for csv file!')
-            elif not self.is_csv:
-                if extension not in ('.xls', '.xlsx'):
-                    raise CommandError('Wrong file format. Supported are: .xlsx, .xls')
-                self.work_book = open_workbook(self.filename)
+            name, compression = split_compression(filename)
+            file_format = self.format or format_of(name)
+            if file_format is None:
+                raise CommandError('Unknown format of file {}, set it by --format'.format(filename))
+            file_format, format_compression = split_compression(file_format)
+            self.__open_with_reader(self.filename, file_format, compression or format_compression)
 
     def __check_and_load_sheet(self):
         # We will verify and load given sheet if it's exists or use first one.
@@ -403,15 +1390,21 @@ class BaseParser(with_metaclass(ParserMetaclass, BaseCommand)):
         except ImportError:
             raise CommandError('No progressbar package found! Please, install it to track progress')
 
-    def __process_result(self, res):
+    def __process_result(self, res, row=None, row_number=None):
         status = res['status']
+        self.__emit(res.get('row_number', row_number), status, res['message'], res.get('row', row))
         if status == 'Success':
             self.parsed_successfully += 1
+            logger.debug('%s', res['message'])
         elif status == 'Failure':
             self.parsed_unsuccessfully += 1
-            self.failed_rows += res['row']
+            self.__save_failed_row([res.get('row_number'), res['message']] + list(res['row']))
+            if self.delta_store is not None:
+                # Failed row is parsed again next time
+                self.delta_pending.pop(res.get('row_number'), None)
+            self.__log_failure('%s', res['message'])
         elif status == 'Skipped':
             self.skipped += 1
+            logger.debug('%s', res['message'])
         else:
-            raise CommandError('Unexpected result returned')
-        print res['message']
\ No newline at end of file
+            raise CommandError('Unexpected result returned')
\ No newline at end of file
@@ -0,0 +1,173 @@
+from contextlib import contextmanager
+from collections import OrderedDict
+from timeit import default_timer
+
+
+class CountingCursor(object):
+    """
+    Proxy of database cursor, which counts executed queries
+    """
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.cursor.__exit__(*exc_info)
+
+    def execute(self, sql, params=None):
+        self.counter['queries'] += 1
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.counter['queries'] += 1
+        return self.cursor.executemany(sql, param_list)
+
+
+def install_query_counter(connection, counter):
+    # Nothing is kept per query (unlike connection.queries), so large imports are counted too
+    make_cursor = connection.make_cursor
+    make_debug_cursor = connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: CountingCursor(make_cursor(cursor), counter)
+    connection.make_debug_cursor = lambda cursor: CountingCursor(make_debug_cursor(cursor), counter)
+
+
+def _restore(connection, names):
+    # Instance attributes are removed, so methods of connection are used again
+    for name in names:
+        try:
+            delattr(connection, name)
+        except AttributeError:
+            pass
+
+
+def uninstall_query_counter(connection):
+    _restore(connection, ('make_cursor', 'make_debug_cursor'))
+
+
+@contextmanager
+def count_queries(connection):
+    counter = {'queries': 0}
+    install_query_counter(connection, counter)
+    try:
+        yield counter
+    finally:
+        uninstall_query_counter(connection)
+
+
+class Stage(object):
+    __slots__ = ('calls', 'seconds', 'queries')
+
+    def __init__(self, calls=0, seconds=0.0, queries=0):
+        self.calls = calls
+        self.seconds = seconds
+        self.queries = queries
+
+
+class Profiler(object):
+    """
+    Accumulates time, calls and database queries of parsing stages.
+    Only wrapped functions are measured, so nothing is spent on
+    profiling unless parser wraps them.
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.counter = {'queries': 0}
+        self.connection = None
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = Stage()
+        return self.stages[name]
+
+    def wrap(self, name, function):
+        stage = self.stage(name)
+        counter = self.counter
+
+        def profiled(*args, **kwargs):
+            queries = counter['queries']
+            start = default_timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stage.seconds += default_timer() - start
+                stage.calls += 1
+                stage.queries += counter['queries'] - queries
+        return profiled
+
+    def iterate(self, name, iterable):
+        # Measures every step of iterator, e.g. reading of rows
+        stage = self.stage(name)
+        iterator = iter(iterable)
+        while True:
+            start = default_timer()
+            try:
+                item = next(iterator)
+            finally:
+                stage.seconds += default_timer() - start
+            stage.calls += 1
+            yield item
+
+    def install(self, connection):
+        # Queries and commits are measured for given connection only
+        self.connection = connection
+        install_query_counter(connection, self.counter)
+        connection.commit = self.wrap('commit', connection.commit)
+        connection.savepoint = self.wrap('savepoint', connection.savepoint)
+        connection.savepoint_commit = self.wrap('savepoint', connection.savepoint_commit)
+        connection.savepoint_rollback = self.wrap('savepoint', connection.savepoint_rollback)
+
+    def uninstall(self):
+        if self.connection is None:
+            return
+        uninstall_query_counter(self.connection)
+        _restore(self.connection, ('commit', 'savepoint', 'savepoint_commit', 'savepoint_rollback'))
+        self.connection = None
+
+    def reset(self):
+        # Stages are zeroed in place, as wrapped functions keep references to them
+        for stage in self.stages.values():
+            stage.calls = stage.queries = 0
+            stage.seconds = 0.0
+
+    def snapshot(self):
+        return [(name, stage.calls, stage.seconds, stage.queries) for name, stage in self.stages.items()]
+
+    def merge(self, snapshot):
+        for name, calls, seconds, queries in snapshot:
+            stage = self.stage(name)
+            stage.calls += calls
+            stage.seconds += seconds
+            stage.queries += queries
+
+    def report(self):
+        lines = []
+        for name, stage in sorted(self.stages.items(), key=lambda item: -item[1].seconds):
+            if stage.calls:
+                lines.append('{}: {:.4f}s, {} calls, {} queries'.format(name, stage.seconds, stage.calls, stage.queries))
+        return lines
+
+
+class ProfiledColumn(object):
+    """
+    Proxy of column, which measures cleaning of its cells
+    """
+    def __init__(self, column, profiler):
+        self.column = column
+        name = 'column {}'.format(column.title)
+        self.clean = profiler.wrap(name, column.clean)
+        self.clean_cell = profiler.wrap(name, column.clean_cell)
+        self.clean_batch = profiler.wrap('{} (batch)'.format(name), column.clean_batch)
+        if hasattr(column, 'prefetch_objects'):
+            self.prefetch_objects = profiler.wrap('{} (prefetch)'.format(name), column.prefetch_objects)
+
+    def __getattr__(self, name):
+        return getattr(self.column, name)
@@ -0,0 +1,187 @@
+"""
+Readers of source formats, looked up by --format or extension of file.
+Dependency of every reader is imported only when it's used, so e.g.
+xlrd isn't loaded to parse .csv file.
+
+Reader has `kind`, `has_header`, `compressible` (whether .gz, .bz2,
+.xz and .zst files of format are decompressed on the fly) and
+open(source, parser) method, which takes path or file object and returns:
+- 'csv': file object, which lines are passed to reader(lines);
+- 'sheet': book with xlrd-like API (sheet_by_index, sheet_by_name, datemode);
+- 'rows': iterable of rows with values in order of columns of parser.
+"""
+import os
+import csv
+import json
+from itertools import izip
+
+from django.core.management import CommandError
+from django.utils import six
+from django.utils.module_loading import import_string
+
+
+class Rows(object):
+    """
+    Iterable of rows, which amount is known in advance
+    """
+    def __init__(self, rows, length):
+        self.rows = rows
+        self.length = length
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return self.length
+
+
+def _open(source):
+    return open(source, 'rb') if isinstance(source, six.string_types) else source
+
+
+class CSVReader(object):
+    """
+    Text file with delimited values; takes dialect and formatting
+    parameters of csv module, e.g. CSVReader(delimiter='|')
+    """
+    kind = 'csv'
+    has_header = True
+    compressible = True
+
+    def __init__(self, dialect='excel', **fmtparams):
+        self.dialect = dialect
+        self.fmtparams = fmtparams
+
+    def open(self, source, parser):
+        return _open(source)
+
+    def reader(self, lines):
+        return csv.reader(lines, self.dialect, **self.fmtparams)
+
+
+class XLSReader(object):
+    kind = 'sheet'
+    has_header = True
+    compressible = False
+
+    def open(self, source, parser):
+        try:
+            from xlrd import open_workbook
+        except ImportError:
+            raise CommandError('No xlrd package found! Please, install it to parse .xls files')
+        if isinstance(source, six.string_types):
+            return open_workbook(source, on_demand=True)
+        return open_workbook(file_contents=source.read(), on_demand=True)
+
+
+class XLSXReader(object):
+    kind = 'sheet'
+    has_header = True
+    compressible = False
+
+    def open(self, source, parser):
+        try:
+            from xlsx import XLSXBook
+        except ImportError:
+            raise CommandError('No xlrd package found! Please, install it to parse .xlsx files')
+        # Rows of selected sheet are streamed instead of loading whole workbook
+        return XLSXBook(source)
+
+
+class JSONLinesReader(object):
+    """
+    Every line is JSON array of values in order of columns or JSON
+    object with values keyed by titles of columns; there is no header
+    """
+    kind = 'rows'
+    has_header = False
+    compressible = True
+
+    def open(self, source, parser):
+        return self._rows(_open(source), list(parser.fields))
+
+    def _rows(self, lines, titles):
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            values = json.loads(line)
+            if isinstance(values, dict):
+                values = [values.get(title) for title in titles]
+            # Missing values are empty, just like empty cells of spreadsheet
+            yield [u'' if value is None else value for value in values]
+
+
+class ParquetReader(object):
+    """
+    Only columns of parser are read, one row group at a time (pyarrow required)
+    """
+    kind = 'rows'
+    has_header = False
+    compressible = False
+
+    def open(self, source, parser):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise CommandError('No pyarrow package found! Please, install it to parse .parquet files')
+        parquet_file = pyarrow.parquet.ParquetFile(source)
+        names = set(parquet_file.schema.names)
+        titles = list(parser.fields)
+        return Rows(
+            self._rows(parquet_file, titles, [title for title in titles if title in names]),
+            parquet_file.metadata.num_rows
+        )
+
+    def _rows(self, parquet_file, titles, columns):
+        for index in xrange(parquet_file.num_row_groups):
+            table = parquet_file.read_row_group(index, columns=columns)
+            data = table.to_pydict()
+            empty = [u''] * table.num_rows
+            values = [
+                [u'' if value is None else value for value in data[title]] if title in data else empty
+                for title in titles
+            ]
+            for row in izip(*values):
+                yield row
+
+
+_readers = {}
+_extensions = {}
+
+
+def register_reader(name, reader, extensions=()):
+    """
+    Register reader of format and extensions of its files. Reader can be
+    given by dotted path to its class or instance, which is imported
+    only when file of this format is parsed.
+    """
+    _readers[name] = reader
+    for extension in extensions:
+        _extensions[extension] = name
+
+
+def get_reader(name):
+    try:
+        reader = _readers[name]
+    except KeyError:
+        raise CommandError('Wrong file format. Supported are: {}'.format(', '.join(sorted(_readers))))
+    if isinstance(reader, six.string_types):
+        reader = import_string(reader)
+        if isinstance(reader, type):
+            reader = reader()
+        _readers[name] = reader
+    return reader
+
+
+def format_of(filename):
+    # Format of file by its extension, None if it's unknown
+    return _extensions.get(os.path.splitext(filename)[1].lower())
+
+
+register_reader('csv', CSVReader(), ('.csv',))
+register_reader('tsv', CSVReader(delimiter='\t'), ('.tsv', '.tab'))
+register_reader('xls', XLSReader(), ('.xls',))
+register_reader('xlsx', XLSXReader(), ('.xlsx',))
+register_reader('jsonl', JSONLinesReader(), ('.jsonl', '.ndjson'))
+register_reader('parquet', ParquetReader(), ('.parquet',))
@@ -0,0 +1,155 @@
+"""
+Splitting of .csv file into byte ranges, which start at row boundaries,
+so disjoint ranges can be parsed by separate processes or nodes.
+"""
+import os
+import csv
+import mmap
+
+# States of probing parser
+FIELD_START, UNQUOTED, QUOTED, QUOTE_IN_QUOTED = range(4)
+
+
+class CSVSplitter(object):
+    """
+    Memory-mapped .csv file, which is split into roughly equal byte
+    ranges without scanning it all: only a few rows after every split
+    point are read. As newline inside of quoted value looks just like
+    end of row, every candidate boundary is verified by probing
+    `probe_rows` rows after it: they must be quoted properly (quote
+    opens value or is escaped inside of it) and have the same amount
+    of values as the first row of file.
+    """
+    probe_rows = 16
+
+    def __init__(self, path, header=True, dialect='excel', **fmtparams):
+        self.header = header
+        self.dialect = dialect
+        self.fmtparams = fmtparams
+        # Quoting of values is checked by probe without csv module
+        reader = csv.reader([], dialect, **fmtparams)
+        self.delimiter = reader.dialect.delimiter
+        self.quotechar = reader.dialect.quotechar if reader.dialect.quoting != csv.QUOTE_NONE else None
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        # Empty file can't be mapped
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.width = None
+        self.data_start = 0
+        for row, end in self.__read_rows(0):
+            self.width = len(row)
+            if header:
+                self.data_start = end
+            break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        self.file.close()
+
+    def ranges(self, parts):
+        """
+        List of (start, end) byte offsets of up to `parts` ranges, which
+        cover all rows of file (except header); ranges may be fewer than
+        parts, if file has fewer rows
+        """
+        start = self.data_start
+        if start >= self.size:
+            return []
+        step = (self.size - start) / float(parts)
+        boundaries = [start]
+        for part in range(1, parts):
+            boundary = self.find_boundary(max(int(start + step * part), boundaries[-1] + 1))
+            if boundary >= self.size:
+                break
+            boundaries.append(boundary)
+        boundaries.append(self.size)
+        return zip(boundaries[:-1], boundaries[1:])
+
+    def find_boundary(self, offset):
+        # Start of first row at or after offset, end of file if there is none
+        position = offset
+        while position < self.size:
+            newline = self.map.find(b'\n', max(position - 1, 0))
+            if newline == -1:
+                break
+            candidate = newline + 1
+            if self.__is_row_start(candidate):
+                return candidate
+            position = candidate + 1
+        return self.size
+
+    def rows(self, start, end):
+        """
+        Rows, which start in range [start, end); start must be at row boundary
+        """
+        if start >= end:
+            return
+        for row, row_end in self.__read_rows(start):
+            yield row
+            if row_end >= end:
+                return
+
+    def __is_row_start(self, position):
+        delimiter, quotechar = self.delimiter, self.quotechar
+        state = FIELD_START
+        values = 1
+        rows = 0
+        line_start = True
+        for line in self.__lines(position, [position]):
+            for char in line:
+                if state == QUOTED:
+                    if char == quotechar:
+                        state = QUOTE_IN_QUOTED
+                    continue
+                if char == '\n':
+                    # Blank lines don't tell anything
+                    if not line_start:
+                        if values != self.width:
+                            return False
+                        rows += 1
+                        if rows >= self.probe_rows:
+                            return True
+                    state, values, line_start = FIELD_START, 1, True
+                    continue
+                if line_start and char == '\r':
+                    continue
+                line_start = False
+                if char == delimiter:
+                    state = FIELD_START
+                    values += 1
+                elif state == FIELD_START:
+                    state = QUOTED if char == quotechar else UNQUOTED
+                elif state == UNQUOTED:
+                    if char == quotechar:
+                        # Quote in the middle of unquoted value: position is inside of quoted one
+                        return False
+                elif state == QUOTE_IN_QUOTED:
+                    if char == quotechar:
+                        state = QUOTED
+                    elif char != '\r':
+                        return False
+        # End of file is reached, last row may have no newline
+        return state != QUOTED and (line_start or values == self.width)
+
+    def __read_rows(self, start):
+        # Yields rows with offset of their end; reader takes lines only till its row is complete
+        end = [start]
+        reader = csv.reader(self.__lines(start, end), self.dialect, **self.fmtparams)
+        for row in reader:
+            yield row, end[0]
+
+    def __lines(self, start, end):
+        position = start
+        while position < self.size:
+            newline = self.map.find(b'\n', position)
+            next_position = self.size if newline == -1 else newline + 1
+            line = self.map[position:next_position]
+            end[0] = position = next_position
+            yield line
@@ -13,3 +13,8 @@ class TestModel(models.Model):
 
 class BasicModel(TestModel):
     text = models.CharField(max_length=100)
+
+
+class KeyedModel(TestModel):
+    code = models.CharField(max_length=20, unique=True)
+    text = models.CharField(max_length=100, null=True)
@@ -1,10 +1,17 @@
 from datetime import datetime
+from unittest import skipIf
 
 from django.test import TestCase
+from xlrd import XL_CELL_DATE, XL_CELL_TEXT
 
 from telega_megaimport import columns
 from telega_megaimport.tests.models import BasicModel
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class BaseColumnTest(TestCase):
     def setUp(self):
@@ -36,6 +43,21 @@ class BaseColumnTest(TestCase):
         result = self.cell_1.validate('test')
         self.assertEqual(result, None)
 
+    def test_clean(self):
+        self.assertEqual(self.cell_1.clean(None), (None, ['Empty value']))
+        self.assertEqual(self.cell_1.clean('test'), ('test', None))
+
+    def test_custom_column_clean(self):
+        class DoubleColumn(columns.IntegerColumn):
+            def normalize(self, value):
+                return int(value) * 2
+
+        cell = DoubleColumn()
+        self.assertEqual(cell.clean('2'), (4, None))
+        self.assertEqual(cell.clean('ttt'), (None, ['Not convertable to integer']))
+        # Batch clean of parent column would skip overridden normalize
+        self.assertEqual(cell.clean_batch(['2', '3']), (['2', '3'], [True, True]))
+
 
 class EmptyColumnTest(TestCase):
     def setUp(self):
@@ -74,6 +96,25 @@ class IntegerColumnTest(TestCase):
         self.assertEqual(self.cell.validate('111'), None)
         self.assertEqual(self.cell.validate('ttt'), ['Not convertable to integer'])
 
+    def test_clean(self):
+        self.assertEqual(self.cell.clean('111'), (111, None))
+        self.assertEqual(self.cell.clean('ttt'), (None, ['Not convertable to integer']))
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_clean_batch(self):
+        values, invalid = self.cell.clean_batch(['1', ' 2 ', 'ttt', '4', '', '1.5', 7.0])
+        self.assertEqual(invalid, [False, False, True, False, True, True, False])
+        self.assertEqual([value for value, failed in zip(values, invalid) if not failed], [1, 2, 4, 7])
+        self.assertIs(type(values[0]), int)
+        self.assertEqual(self.cell.clean_batch(['99999999999999999999'])[1], [True])
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_clean_batch_floats(self):
+        # Numeric cells of spreadsheets and JSON Lines come as floats
+        values, invalid = self.cell.clean_batch([3.0, 1e19, float('nan'), -1e19, float('inf'), -2.0 ** 63])
+        self.assertEqual(invalid, [False, True, True, True, True, False])
+        self.assertEqual([values[0], values[5]], [3, -2 ** 63])
+
 
 class BooleanColumnTest(TestCase):
     def setUp(self):
@@ -88,6 +129,18 @@ class BooleanColumnTest(TestCase):
         self.assertEqual(self.cell.validate('test'), ['Value cannot be parsed as boolean'])
         self.assertEqual(self.cell.validate('+'), None)
 
+    def test_clean(self):
+        self.assertEqual(self.cell.clean('Yes'), (True, None))
+        self.assertEqual(self.cell.clean('-'), (False, None))
+        self.assertEqual(self.cell.clean('test'), (None, ['Value cannot be parsed as boolean']))
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_clean_batch(self):
+        self.assertEqual(self.cell.clean_batch(['Yes', '-', 'test', u'TRUE']), (
+            [True, False, False, True], [False, False, True, False]
+        ))
+        self.assertEqual(self.cell.clean_batch([True, 'yes'])[1], [True, True])
+
 
 class FloatColumnTest(TestCase):
     def setUp(self):
@@ -101,6 +154,16 @@ class FloatColumnTest(TestCase):
         self.assertEqual(self.cell.validate('111.111'), None)
         self.assertEqual(self.cell.validate('ttt'), ['Not convertable to float'])
 
+    def test_clean(self):
+        self.assertEqual(self.cell.clean('111.111'), (111.111, None))
+        self.assertEqual(self.cell.clean('ttt'), (None, ['Not convertable to float']))
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_clean_batch(self):
+        values, invalid = self.cell.clean_batch(['111.111', '1e3', 'ttt'])
+        self.assertEqual(values[:2], [111.111, 1000.0])
+        self.assertEqual(invalid, [False, False, True])
+
 
 class DateTimeColumn(TestCase):
     def setUp(self):
@@ -117,6 +180,37 @@ class DateTimeColumn(TestCase):
         self.assertEqual(self.cell.validate('1/4/2017'), None)
         self.assertEqual(self.cell.validate('ttt'), ['Unknown string format'])
 
+    def test_clean(self):
+        self.assertEqual(self.cell.clean('1/4/2017'), (datetime(day=1, year=2017, month=4), None))
+        self.assertEqual(self.cell.clean('ttt'), (None, ['Unknown string format']))
+
+    def test_formats(self):
+        cell = columns.DateTimeColumn(formats=['%d.%m.%Y'], dayfirst=True)
+        self.assertEqual(cell.normalize('01.04.2017'), datetime(day=1, year=2017, month=4))
+        self.assertEqual(cell.normalize('1/4/2017'), datetime(day=1, year=2017, month=4))
+
+    def test_clean_cell(self):
+        self.assertEqual(self.cell.clean_cell(42826.5, XL_CELL_DATE, 0), (datetime(2017, 4, 1, 12), None))
+        self.assertEqual(self.cell.clean_cell(41364.5, XL_CELL_DATE, 1), (datetime(2017, 4, 1, 12), None))
+        self.assertEqual(self.cell.clean_cell(u'1/4/2017', XL_CELL_TEXT, 0), (datetime(2017, 4, 1), None))
+
+    def test_custom_column_clean_cell(self):
+        class SerialColumn(columns.DateTimeColumn):
+            def normalize(self, value):
+                return 'serial {}'.format(value)
+
+        # Raw cell is passed to overridden normalize, just like before cell types were known
+        self.assertEqual(SerialColumn().clean_cell(42826.5, XL_CELL_DATE, 0), ('serial 42826.5', None))
+
+    def test_cache(self):
+        cell = columns.DateTimeColumn(dayfirst=True, cache_size=1)
+        cell.clean('1/4/2017')
+        cell.clean('1/4/2017')
+        self.assertEqual(cell.clean('ttt'), (None, ['Unknown string format']))
+        self.assertEqual(cell.clean('ttt'), (None, ['Unknown string format']))
+        cell.clean('1/4/2017')
+        self.assertEqual(cell.statistics, {'cache_hits': 2, 'cache_misses': 3})
+
 
 
 class ModelColumnTest(TestCase):
@@ -142,3 +236,53 @@ class ModelColumnTest(TestCase):
     def test_validate(self):
         self.assertEqual(self.cell.validate(self.model_1.pk), None)
         self.assertEqual(self.cell.validate(101010101), ['Object not found'])
+
+    def test_clean(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cell.clean(self.model_1.pk), (self.model_1, None))
+        self.assertEqual(self.cell.clean(101010101), (None, ['Object not found']))
+
+    def test_multiple_objects(self):
+        self.assertEqual(self.cell_text.validate('tr'), ['Multiple objects found'])
+
+    def test_prefetch(self):
+        cell = columns.ModelColumn(queryset=BasicModel.objects.all(), prefetch=True)
+        with self.assertNumQueries(1):
+            cell.prefetch_objects([str(self.model_1.pk), str(self.model_2.pk), '1010101', 'ttt'])
+        with self.assertNumQueries(0):
+            self.assertEqual(cell.normalize(str(self.model_1.pk)), self.model_1)
+            self.assertEqual(cell.validate(str(self.model_2.pk)), None)
+            self.assertEqual(cell.validate('1010101'), ['Object not found'])
+            self.assertEqual(cell.validate('ttt'), ['Invalid lookup'])
+
+    def test_prefetch_batches(self):
+        cell = columns.ModelColumn(queryset=BasicModel.objects.all(), prefetch=True)
+        with self.assertNumQueries(2):
+            cell.prefetch_objects([str(self.model_1.pk), str(self.model_2.pk), '1010101'], batch_size=2)
+        with self.assertNumQueries(0):
+            self.assertEqual(cell.normalize(str(self.model_1.pk)), self.model_1)
+            self.assertEqual(cell.normalize(str(self.model_2.pk)), self.model_2)
+            self.assertEqual(cell.validate('1010101'), ['Object not found'])
+
+    def test_prefetch_multiple_objects(self):
+        BasicModel.objects.create(text='tralala')
+        cell = columns.ModelColumn(queryset=BasicModel.objects.all(), lookup_arg='text', prefetch=True)
+        cell.prefetch_objects(['tralala', 'trololo'])
+        with self.assertNumQueries(0):
+            self.assertEqual(cell.validate('tralala'), ['Multiple objects found'])
+            self.assertEqual(cell.normalize('trololo'), self.model_2)
+
+
+class ModelTypeColumnTest(TestCase):
+    def setUp(self):
+        self.cell = columns.ModelTypeColumn()
+        self.app_cell = columns.ModelTypeColumn(applabel='tests')
+
+    def test_validate(self):
+        self.assertEqual(self.cell.validate('BasicModel'), None)
+        self.assertEqual(self.cell.validate('Missing'), ['Model not found'])
+
+    def test_clean(self):
+        self.assertEqual(self.cell.clean('BasicModel'), (BasicModel, None))
+        self.assertEqual(self.app_cell.clean('basicmodel'), (BasicModel, None))
+        self.assertEqual(self.app_cell.clean('Missing'), (None, ['Model not found']))
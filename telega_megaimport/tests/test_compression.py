@@ -0,0 +1,55 @@
+import bz2
+import gzip
+from io import BytesIO
+from unittest import skipIf
+
+from django.core.management import CommandError
+from django.test import SimpleTestCase
+
+from telega_megaimport.compression import DecompressingFile, split_compression
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def gzipped(data):
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class SplitCompressionTest(SimpleTestCase):
+    def test_split(self):
+        self.assertEqual(split_compression('/tmp/data.csv.gz'), ('/tmp/data.csv', 'gzip'))
+        self.assertEqual(split_compression('jsonl.ZST'), ('jsonl', 'zstd'))
+        self.assertEqual(split_compression('data.csv'), ('data.csv', None))
+
+
+class DecompressingFileTest(SimpleTestCase):
+    def read(self, data, compression, block_size=4):
+        stream = DecompressingFile(BytesIO(data), compression)
+        stream.block_size = block_size
+        return list(stream), stream.compressed_read
+
+    def test_lines_split_between_blocks(self):
+        data = gzipped(b'text,number\nfirst,1\r\nlast')
+        lines, compressed_read = self.read(data, 'gzip')
+        self.assertEqual(lines, [b'text,number\n', b'first,1\r\n', b'last'])
+        self.assertEqual(compressed_read, len(data))
+
+    def test_concatenated_gzip(self):
+        lines, _ = self.read(gzipped(b'a\nb') + gzipped(b'c\n'), 'gzip', block_size=1 << 16)
+        self.assertEqual(lines, [b'a\n', b'bc\n'])
+
+    def test_concatenated_bz2_at_block_boundary(self):
+        first = bz2.compress(b'a\n')
+        lines, _ = self.read(first + bz2.compress(b'b\n'), 'bz2', block_size=len(first))
+        self.assertEqual(lines, [b'a\n', b'b\n'])
+
+    @skipIf(zstandard is not None, 'zstandard is installed')
+    def test_missing_dependency(self):
+        with self.assertRaisesMessage(CommandError, 'No zstandard package found'):
+            DecompressingFile(BytesIO(), 'zstd')
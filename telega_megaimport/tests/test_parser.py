@@ -0,0 +1,998 @@
+import os
+import re
+import bz2
+import csv
+import glob
+import gzip
+import json
+import logging
+import operator
+import sys
+import time
+import types
+import threading
+import shutil
+import tempfile
+from datetime import datetime
+from StringIO import StringIO
+from unittest import skipIf
+
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command, CommandError
+
+from telega_megaimport import columns
+from telega_megaimport.parser import BaseParser, RowResult
+from telega_megaimport.bulk import INSERTERS, _merge_with_orm, _merge_with_staging
+from telega_megaimport.readers import CSVReader, register_reader, _readers, _extensions
+from telega_megaimport.tests.models import BasicModel, KeyedModel
+from telega_megaimport.tests.test_xlsx import write_xlsx
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class RecordingParser(BaseParser):
+    text = columns.StringColumn()
+    number = columns.IntegerColumn()
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingParser, self).__init__(*args, **kwargs)
+        self.rows = []
+
+    def row(self, values):
+        self.rows.append(values)
+
+
+class PrefetchingParser(RecordingParser):
+    text = columns.StringColumn()
+    model = columns.ModelColumn(queryset=BasicModel.objects.all(), lookup_arg='text', prefetch=True)
+
+
+class HandlerParser(RecordingParser):
+    text = columns.StringColumn()
+    skipped = columns.EmptyColumn()
+    number = columns.IntegerColumn()
+
+    def number_handler(self, value):
+        return value * 10
+
+
+class CreatingParser(BaseParser):
+    text = columns.StringColumn()
+
+    def row(self, values):
+        BasicModel.objects.create(text=values['text'])
+        if values['text'] == 'broken':
+            raise ValueError('Broken row')
+
+
+class SinkParser(BaseParser):
+    text = columns.StringColumn(required=False)
+    sink_model = BasicModel
+    sink_batch_size = 2
+
+    def sink(self, values):
+        if values.get('text') == 'instance':
+            return BasicModel(text='instance')
+        elif values.get('text') == 'null':
+            return {'text': None}
+        return {'text': values.get('text')}
+
+
+class SucceedingParser(RecordingParser):
+    text = columns.StringColumn()
+    number = columns.IntegerColumn()
+
+    def row(self, values):
+        return self.success('Row {} is imported'.format(values['number']))
+
+
+class FailingParser(RecordingParser):
+    text = columns.StringColumn()
+    number = columns.IntegerColumn()
+
+    def row(self, values):
+        if values['number'] % 3 == 0:
+            raise ValueError('Broken row')
+
+
+class StubCell(object):
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+class StubWorksheet(object):
+    """
+    Mimics gspread Worksheet; records API requests
+    """
+    def __init__(self, rows, row_count):
+        self.rows = rows
+        self.row_count = row_count
+        self.requests = []
+
+    def row_values(self, row):
+        self.requests.append('row_values')
+        return self.rows[row - 1]
+
+    def range(self, label):
+        self.requests.append(label)
+        first_col, first_row, last_col, last_row = re.match(r'([A-Z]+)(\d+):([A-Z]+)(\d+)', label).groups()
+        return [
+            StubCell(row, col, self.rows[row - 1][col - 1] if row <= len(self.rows) else '')
+            for row in range(int(first_row), int(last_row) + 1)
+            for col in range(ord(first_col) - 64, ord(last_col) - 63)
+        ]
+
+    def cell(self, row, col):
+        raise AssertionError('Cells must not be fetched one by one')
+
+
+class StubSpreadsheet(object):
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def get_worksheet(self, index):
+        return self.worksheet
+
+
+class StubClient(object):
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open(self, name):
+        return self.spreadsheet
+
+
+class DateParser(RecordingParser):
+    date = columns.DateTimeColumn(formats=['%Y-%m-%d'])
+
+
+class ParserTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write_csv(self, content, name='data.csv'):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def run_parser(self, parser, *args, **options):
+        # Statistics files are saved to working directory
+        cwd = os.getcwd()
+        stdout = sys.stdout
+        os.chdir(self.dir)
+        sys.stdout = self.output = StringIO()
+        try:
+            call_command(parser, *args, stdout=self.output, **options)
+        finally:
+            sys.stdout = stdout
+            os.chdir(cwd)
+        return parser
+
+    def read_failed_rows(self):
+        path, = glob.glob(os.path.join(self.dir, 'failed_rows_*.csv'))
+        with open(path, 'rb') as f:
+            return list(csv.reader(f, delimiter=';'))
+
+
+class CSVParsingTest(ParserTestCase):
+    def setUp(self):
+        super(CSVParsingTest, self).setUp()
+        self.path = self.write_csv('text,number\nfirst,1\nsecond,2\n')
+
+    def test_parse(self):
+        parser = self.run_parser(RecordingParser(), self.path)
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 1}, {'text': 'second', 'number': 2}])
+        self.assertEqual(parser.parsed_successfully, 2)
+
+    def test_success_result(self):
+        parser = self.run_parser(SucceedingParser(), self.path)
+        self.assertEqual(parser.parsed_successfully, 2)
+        self.assertIn('Successfully parsed 2 items.', self.output.getvalue())
+
+    def test_stream(self):
+        parser = self.run_parser(RecordingParser(), self.path, stream='True')
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 1}, {'text': 'second', 'number': 2}])
+        self.assertEqual(parser.bytes_read, os.path.getsize(self.path))
+
+
+class FormatsTest(ParserTestCase):
+    def test_tsv(self):
+        path = self.write_csv('text\tnumber\nfirst, comma\t1\n', name='data.tsv')
+        parser = self.run_parser(RecordingParser(), path)
+        self.assertEqual(parser.rows, [{'text': 'first, comma', 'number': 1}])
+
+    def test_explicit_format(self):
+        path = self.write_csv('text\tnumber\nfirst\t1\n', name='data.txt')
+        parser = self.run_parser(RecordingParser(), path, format='tsv')
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 1}])
+
+    def test_unknown_extension(self):
+        path = self.write_csv('text,number\n', name='data.txt')
+        with self.assertRaisesMessage(CommandError, 'Unknown format of file'):
+            self.run_parser(RecordingParser(), path)
+
+    def test_json_lines(self):
+        path = self.write_csv('["first", 1]\n\n{"number": 2, "text": "second"}\n{"text": "third"}\n', name='data.jsonl')
+        parser = self.run_parser(RecordingParser(), path, savestats='True')
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 1}, {'text': 'second', 'number': 2}, {'text': 'third'}])
+        self.assertEqual(parser.parsed_successfully, 3)
+
+    def test_registered_reader(self):
+        register_reader('psv', CSVReader(delimiter='|'), ('.psv',))
+        # Registry is global, so formats of test don't leak into others
+        self.addCleanup(_readers.pop, 'psv')
+        self.addCleanup(_extensions.pop, '.psv')
+        path = self.write_csv('text|number\nfirst|1\n', name='data.psv')
+        parser = self.run_parser(RecordingParser(), path)
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 1}])
+
+    def test_reader_by_dotted_path(self):
+        register_reader('lazy-jsonl', 'telega_megaimport.readers.JSONLinesReader')
+        self.addCleanup(_readers.pop, 'lazy-jsonl')
+        results = list(RecordingParser().parse(StringIO('["first", 1]\n'), 'lazy-jsonl'))
+        self.assertEqual([result.status for result in results], ['Success'])
+
+    @skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet
+        path = os.path.join(self.dir, 'data.parquet')
+        table = pyarrow.Table.from_arrays([pyarrow.array([1, 2]), pyarrow.array([u'first', None])], ['number', 'text'])
+        pyarrow.parquet.write_table(table, path, row_group_size=1)
+        parser = self.run_parser(RecordingParser(), path)
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 1}, {'number': 2}])
+
+
+class CompressedFilesTest(ParserTestCase):
+    content = 'text,number\n' + ''.join('row,{}\n'.format(number) for number in range(1, 101))
+
+    def write_gzip(self, name='data.csv.gz'):
+        path = os.path.join(self.dir, name)
+        with gzip.open(path, 'wb') as f:
+            f.write(self.content)
+        return path
+
+    def test_gzip(self):
+        path = self.write_gzip()
+        parser = self.run_parser(RecordingParser(), path)
+        self.assertEqual(len(parser.rows), 100)
+        self.assertEqual(parser.rows[-1], {'text': 'row', 'number': 100})
+        # Progress is measured in compressed bytes
+        self.assertEqual(parser.bytes_read, os.path.getsize(path))
+
+    def test_bz2(self):
+        path = os.path.join(self.dir, 'data.csv.bz2')
+        with open(path, 'wb') as f:
+            f.write(bz2.compress(self.content))
+        parser = self.run_parser(RecordingParser(), path, chunk_size=30)
+        self.assertEqual(parser.parsed_successfully, 100)
+
+    def test_format_of_file_object(self):
+        with open(self.write_gzip(), 'rb') as f:
+            results = list(RecordingParser().parse(f, 'csv.gz'))
+        self.assertEqual(len(results), 100)
+
+    def test_explicit_format(self):
+        parser = self.run_parser(RecordingParser(), self.write_gzip('data.gz'), format='csv')
+        self.assertEqual(parser.parsed_successfully, 100)
+
+    def test_checkpoint(self):
+        with self.assertRaisesMessage(CommandError, 'can\'t be saved for compressed files'):
+            self.run_parser(RecordingParser(), self.write_gzip(), chunk_size=10,
+                            checkpoint=os.path.join(self.dir, 'checkpoint.json'))
+
+    def test_not_compressible_format(self):
+        with self.assertRaisesMessage(CommandError, 'Compressed xlsx files are not supported'):
+            self.run_parser(RecordingParser(), self.write_gzip('data.xlsx.gz'))
+
+
+class XLSXParsingTest(ParserTestCase):
+    def setUp(self):
+        super(XLSXParsingTest, self).setUp()
+        self.path = write_xlsx(os.path.join(self.dir, 'data.xlsx'), [
+            (1, ['<c t="inlineStr"><is><t>text</t></is></c>', '<c t="inlineStr"><is><t>number</t></is></c>']),
+            (2, ['<c t="inlineStr"><is><t>first</t></is></c>', '<c><v>1</v></c>']),
+            (3, ['<c t="inlineStr"><is><t>second</t></is></c>', '<c t="inlineStr"><is><t>x</t></is></c>']),
+        ])
+
+    def test_parse(self):
+        parser = self.run_parser(RecordingParser(), self.path)
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 1}, {'text': 'second'}])
+
+    def test_failfast_coordinates(self):
+        with self.assertRaisesMessage(CommandError, 'Errors in cell B3'):
+            self.run_parser(RecordingParser(), self.path, failfast='True')
+
+    def test_workers(self):
+        parser = self.run_parser(RecordingParser(), self.path, workers=2, chunk_size=1)
+        self.assertEqual(parser.parsed_successfully, 2)
+
+    def test_date_cells(self):
+        path = write_xlsx(os.path.join(self.dir, 'dates.xlsx'), [
+            (1, ['<c t="inlineStr"><is><t>date</t></is></c>']),
+            (2, ['<c s="1"><v>42826.5</v></c>']),
+            (3, ['<c t="inlineStr"><is><t>2017-04-02</t></is></c>']),
+        ], date1904=True)
+        parser = self.run_parser(DateParser(), path)
+        self.assertEqual(parser.rows, [{'date': datetime(2021, 4, 2, 12)}, {'date': datetime(2017, 4, 2)}])
+
+
+class RowPlanTest(ParserTestCase):
+    def test_plan(self):
+        path = self.write_csv('text,skipped,number\nfirst,x,1\nsecond,y,z\n')
+        parser = self.run_parser(HandlerParser(), path)
+        self.assertEqual([column.title for _, column, _ in parser.row_plan], ['text', 'number'])
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 10}, {'text': 'second'}])
+
+    def test_failfast_coordinates(self):
+        path = self.write_csv('text,skipped,number\nfirst,x,z\n')
+        with self.assertRaisesMessage(CommandError, 'Errors in cell 2'):
+            self.run_parser(HandlerParser(), path, failfast='True')
+
+
+class ColumnStatisticsTest(ParserTestCase):
+    def setUp(self):
+        super(ColumnStatisticsTest, self).setUp()
+        self.path = self.write_csv('date\n' + '2017-04-01\n2017-04-02\n' * 3)
+        DateParser.date.cache.items.clear()
+
+    def test_cache_statistics(self):
+        self.run_parser(DateParser(), self.path)
+        self.assertIn('Column date: cache hits 4, cache misses 2', self.output.getvalue())
+
+    def test_workers(self):
+        parser = self.run_parser(DateParser(), self.path, workers=2, chunk_size=2)
+        self.assertEqual(sum(parser.date.statistics.values()), 6)
+
+
+class PrefetchTest(ParserTestCase):
+    def test_single_query_per_chunk(self):
+        first = BasicModel.objects.create(text='first')
+        second = BasicModel.objects.create(text='second')
+        path = self.write_csv('text,model\n' + 'a,first\nb,second\nc,missing\n' * 10)
+        parser = PrefetchingParser()
+        with self.assertNumQueries(1):
+            self.run_parser(parser, path)
+        self.assertEqual(parser.parsed_successfully, 30)
+        self.assertEqual(parser.rows[:3], [
+            {'text': 'a', 'model': first}, {'text': 'b', 'model': second}, {'text': 'c'}
+        ])
+
+    def test_chunk_larger_than_prefetch(self):
+        first = BasicModel.objects.create(text='first')
+        path = self.write_csv('text,model\n' + 'a,first\nb,second\nc,missing\n' * 10)
+        parser = PrefetchingParser()
+        parser.prefetch_chunk_size = 2
+        with CaptureQueriesContext(connection) as queries:
+            self.run_parser(parser, path, chunk_size=12)
+        # Lookups of every chunk are resolved before it's parsed, none of rows is looked up by its own query
+        lookups = [query['sql'] for query in queries if 'FROM "tests_basicmodel"' in query['sql']]
+        self.assertEqual(len(lookups), 6)
+        self.assertTrue(all(' IN (' in sql for sql in lookups))
+        self.assertEqual(parser.parsed_successfully, 30)
+        self.assertEqual([row.get('model') for row in parser.rows[-3:]], [first, None, None])
+
+
+class FailedRowsTest(ParserTestCase):
+    def test_saved_rows(self):
+        path = self.write_csv('text,number\nfirst,3\nsecond,4\n"th;ird",6\n')
+        parser = self.run_parser(FailingParser(), path, savestats='True')
+        self.assertEqual(parser.parsed_unsuccessfully, 2)
+        self.assertEqual(self.read_failed_rows(), [
+            ['Row', 'Error', 'text', 'number'],
+            ['0', 'Error during parsing row 0: Broken row', 'first', '3'],
+            ['2', 'Error during parsing row 2: Broken row', 'th;ird', '6'],
+        ])
+        self.assertEqual(len(glob.glob(os.path.join(self.dir, 'parse_statistics_*.txt'))), 1)
+
+
+class SampledFailingParser(FailingParser):
+    text = columns.StringColumn()
+    number = columns.IntegerColumn()
+    failure_log_limit = 2
+    failure_log_every = 3
+
+
+class LoggingTest(ParserTestCase):
+    def setUp(self):
+        super(LoggingTest, self).setUp()
+        self.path = self.write_csv('text,number\n' + ''.join('row,{}\n'.format(number) for number in range(1, 25)))
+
+    def test_default_verbosity(self):
+        self.run_parser(FailingParser(), self.path)
+        output = self.output.getvalue()
+        self.assertNotIn('parsed successfully', output)
+        self.assertIn('Error during parsing row 2: Broken row', output)
+        self.assertIn('Successfully parsed 16 items.', output)
+
+    def test_debug_verbosity(self):
+        self.run_parser(FailingParser(), self.path, verbosity=3)
+        self.assertIn('Row 0 parsed successfully', self.output.getvalue())
+
+    def test_quiet(self):
+        self.run_parser(FailingParser(), self.path, verbosity=0)
+        output = self.output.getvalue()
+        self.assertNotIn('Successfully parsed', output)
+        self.assertIn('Error during parsing row 2: Broken row', output)
+
+    def test_level_is_restored(self):
+        logger = logging.getLogger('telega_megaimport')
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.ERROR)
+        self.run_parser(FailingParser(), self.path, verbosity=3)
+        self.assertIn('Row 0 parsed successfully', self.output.getvalue())
+        self.assertEqual(logger.level, logging.ERROR)
+
+    def test_configured_level(self):
+        logger = logging.getLogger('telega_megaimport')
+        handler = logging.StreamHandler(StringIO())
+        self.addCleanup(logger.setLevel, logger.level)
+        self.addCleanup(logger.removeHandler, handler)
+        logger.addHandler(handler)
+        logger.setLevel(logging.WARNING)
+        self.run_parser(FailingParser(), self.path, verbosity=3)
+        # Level of logger configured in settings isn't overridden by verbosity
+        self.assertEqual(logger.level, logging.WARNING)
+        self.assertNotIn('parsed successfully', handler.stream.getvalue())
+        self.assertIn('Broken row', handler.stream.getvalue())
+
+    def test_sampled_failures(self):
+        self.run_parser(SampledFailingParser(), self.path)
+        output = self.output.getvalue()
+        # Failures 1, 2, 3 and 6 of 8 are logged
+        self.assertEqual(output.count('Broken row'), 4)
+        self.assertIn('only one of every 3 is logged', output)
+        self.assertIn('Error during parsing row 17: Broken row', output)
+
+        self.run_parser(SampledFailingParser(), self.path, verbosity=2)
+        self.assertEqual(self.output.getvalue().count('Broken row'), 8)
+
+
+class BatchParser(RecordingParser):
+    text = columns.StringColumn()
+    number = columns.IntegerColumn()
+    flag = columns.BooleanColumn()
+    batch_chunk_size = 2
+
+
+@skipIf(numpy is None, 'numpy is not installed')
+class BatchTest(ParserTestCase):
+    def setUp(self):
+        super(BatchTest, self).setUp()
+        self.path = self.write_csv('text,number,flag\nfirst, 1 ,yes\nsecond,x,no\nthird,3,maybe\n')
+
+    def test_batch(self):
+        parser = self.run_parser(BatchParser(), self.path, batch='True')
+        self.assertEqual([column.title for _, column in parser.batch_columns], ['number', 'flag'])
+        self.assertEqual(parser.rows, [
+            {'text': 'first', 'number': 1, 'flag': True},
+            {'text': 'second', 'flag': False},
+            {'text': 'third', 'number': 3},
+        ])
+        self.assertIn("[{1: ['Not convertable to integer']}]", self.output.getvalue())
+
+    def test_same_as_scalar(self):
+        scalar = self.run_parser(BatchParser(), self.path)
+        batch = self.run_parser(BatchParser(), self.path, batch='True', workers=2, chunk_size=2)
+        self.assertEqual(batch.parsed_successfully, scalar.parsed_successfully)
+        self.assertEqual(scalar.batch_columns, ())
+
+    def test_failfast(self):
+        with self.assertRaisesMessage(CommandError, 'Errors in cell 1'):
+            self.run_parser(BatchParser(), self.path, batch='True', failfast='True')
+
+    def test_chunk_larger_than_batch(self):
+        path = self.write_csv('text,number,flag\n' + ''.join('row,{},yes\n'.format(number) for number in range(10)))
+        for chunk_size in (3, 8):
+            parser = self.run_parser(BatchParser(), path, batch='True', chunk_size=chunk_size)
+            self.assertEqual([values['number'] for values in parser.rows], range(10))
+
+
+class ChunkedTransactionTest(ParserTestCase):
+    def test_failed_row_is_isolated(self):
+        path = self.write_csv('text\nfirst\nbroken\nsecond\nthird\n')
+        parser = self.run_parser(CreatingParser(), path, chunk_size=2)
+        self.assertEqual(parser.parsed_successfully, 3)
+        self.assertEqual(parser.parsed_unsuccessfully, 1)
+        self.assertEqual(sorted(BasicModel.objects.values_list('text', flat=True)), ['first', 'second', 'third'])
+
+    def test_rows_before_error_are_committed(self):
+        path = self.write_csv('text\nfirst\n\nsecond\n')
+        with self.assertRaises(CommandError):
+            self.run_parser(CreatingParser(), path, chunk_size=10)
+        self.assertEqual(list(BasicModel.objects.values_list('text', flat=True)), ['first'])
+
+
+class NumberCreatingParser(BaseParser):
+    text = columns.StringColumn()
+    number = columns.IntegerColumn()
+
+    def row(self, values):
+        BasicModel.objects.create(text=values['text'])
+
+
+class CheckpointTest(ParserTestCase):
+    def setUp(self):
+        super(CheckpointTest, self).setUp()
+        self.checkpoint = os.path.join(self.dir, 'checkpoint.json')
+
+    def texts(self):
+        return list(BasicModel.objects.order_by('pk').values_list('text', flat=True))
+
+    def test_resume_csv(self):
+        path = self.write_csv('text,number\nfirst,1\n"sec\nond",2\nthird,3\nfourth,x\nfifth,5\n')
+        with self.assertRaisesMessage(CommandError, 'Errors in cell 1'):
+            self.run_parser(NumberCreatingParser(), path, chunk_size=2, checkpoint=self.checkpoint, failfast='True')
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        self.assertEqual((state['row'], state['parsed_successfully']), (2, 3))
+        # Broken value is fixed, offsets of rows are kept
+        self.write_csv('text,number\nfirst,1\n"sec\nond",2\nthird,3\nfourth,4\nfifth,5\n')
+        parser = self.run_parser(
+            NumberCreatingParser(), path, chunk_size=2, checkpoint=self.checkpoint, resume='True', failfast='True'
+        )
+        self.assertEqual(self.texts(), ['first', 'sec\nond', 'third', 'fourth', 'fifth'])
+        # Progress is measured in bytes, just like with --stream
+        self.assertTrue(parser.stream)
+        self.assertEqual(parser.bytes_read, os.path.getsize(path))
+        self.assertEqual(parser.parsed_successfully, 5)
+
+    def test_resume_xlsx(self):
+        def write(value):
+            return write_xlsx(os.path.join(self.dir, 'data.xlsx'), [
+                (1, ['<c t="inlineStr"><is><t>text</t></is></c>', '<c t="inlineStr"><is><t>number</t></is></c>']),
+                (2, ['<c t="inlineStr"><is><t>first</t></is></c>', '<c><v>1</v></c>']),
+                (3, ['<c t="inlineStr"><is><t>second</t></is></c>', '<c><v>2</v></c>']),
+                (4, ['<c t="inlineStr"><is><t>third</t></is></c>', value]),
+            ])
+        path = write('<c t="inlineStr"><is><t>x</t></is></c>')
+        with self.assertRaisesMessage(CommandError, 'Errors in cell B4'):
+            self.run_parser(NumberCreatingParser(), path, chunk_size=2, checkpoint=self.checkpoint, failfast='True')
+        write('<c><v>3</v></c>')
+        self.run_parser(NumberCreatingParser(), path, chunk_size=2, checkpoint=self.checkpoint, resume='True')
+        self.assertEqual(self.texts(), ['first', 'second', 'third'])
+
+    def test_another_file(self):
+        path = self.write_csv('text,number\nfirst,1\n')
+        self.run_parser(NumberCreatingParser(), path, chunk_size=1, checkpoint=self.checkpoint)
+        other_path = self.write_csv('text,number\nfirst,1\n', name='other.csv')
+        with self.assertRaisesMessage(CommandError, 'is saved for another file'):
+            self.run_parser(NumberCreatingParser(), other_path, chunk_size=1, checkpoint=self.checkpoint, resume='True')
+
+    def test_options(self):
+        path = self.write_csv('text,number\nfirst,1\n')
+        with self.assertRaisesMessage(CommandError, 'set --chunk-size'):
+            self.run_parser(NumberCreatingParser(), path, checkpoint=self.checkpoint)
+        with self.assertRaisesMessage(CommandError, 'Set --checkpoint'):
+            self.run_parser(NumberCreatingParser(), path, resume='True')
+
+
+class DeltaParser(BaseParser):
+    code = columns.StringColumn()
+    text = columns.StringColumn()
+    delta_key = 'code'
+
+    def row(self, values):
+        if values['text'] == 'broken':
+            raise ValueError('Broken row')
+        BasicModel.objects.create(text=values['text'])
+
+
+class DeltaRecordingParser(RecordingParser):
+    code = columns.StringColumn()
+    text = columns.StringColumn()
+    delta_key = 'code'
+
+
+class DeltaTest(ParserTestCase):
+    def setUp(self):
+        super(DeltaTest, self).setUp()
+        self.store = os.path.join(self.dir, 'fingerprints.sqlite')
+        self.path = self.write_csv('code,text\n1,first\n2,second\n3,broken\n')
+
+    def texts(self):
+        return sorted(BasicModel.objects.values_list('text', flat=True))
+
+    def test_unchanged_rows(self):
+        parser = self.run_parser(DeltaParser(), self.path, delta=self.store)
+        self.assertEqual((parser.parsed_successfully, parser.parsed_unsuccessfully), (2, 1))
+        self.write_csv('code,text\n1,first\n2,changed\n3,broken\n4,fourth\n')
+        parser = self.run_parser(DeltaParser(), self.path, delta=self.store, chunk_size=2)
+        self.assertEqual(parser.skipped_unchanged, 1)
+        # Failed row isn't fingerprinted, so it's parsed again
+        self.assertEqual((parser.parsed_successfully, parser.parsed_unsuccessfully), (2, 1))
+        self.assertIn('Skipped 1 unchanged items.', self.output.getvalue())
+        self.assertEqual(self.texts(), ['changed', 'first', 'fourth', 'second'])
+
+    def test_unchanged_file(self):
+        self.write_csv('code,text\n1,first\n2,second\n')
+        self.run_parser(DeltaParser(), self.path, delta=self.store)
+        parser = self.run_parser(DeltaParser(), self.path, delta=self.store)
+        self.assertIn('File is not changed since previous import', self.output.getvalue())
+        self.assertEqual(parser.skipped_unchanged, 0)
+        self.assertEqual(self.texts(), ['first', 'second'])
+
+    def test_workers(self):
+        self.run_parser(DeltaRecordingParser(), self.path, delta=self.store, workers=2, chunk_size=1)
+        self.write_csv('code,text\n1,first\n2,second\n3,third\n')
+        parser = self.run_parser(DeltaRecordingParser(), self.path, delta=self.store, workers=2, chunk_size=1)
+        self.assertEqual((parser.skipped_unchanged, parser.parsed_successfully), (2, 1))
+
+    def test_missing_key(self):
+        with self.assertRaisesMessage(CommandError, 'Set delta_key'):
+            self.run_parser(CreatingParser(), self.path, delta=self.store)
+
+
+class ProfileTest(ParserTestCase):
+    def setUp(self):
+        super(ProfileTest, self).setUp()
+        self.path = self.write_csv('text,skipped,number\nfirst,x,1\nsecond,y,2\nthird,z,3\n')
+
+    def test_profile(self):
+        parser = self.run_parser(HandlerParser(), self.path, profile='True', chunk_size=2, savestats='True')
+        stages = parser.profiler.stages
+        self.assertEqual(stages['reader'].calls, 3)
+        self.assertEqual(stages['column number'].calls, 3)
+        self.assertEqual(stages['handler number_handler'].calls, 3)
+        self.assertEqual(stages['row()'].calls, 3)
+        self.assertEqual(stages['savepoint'].queries, stages['savepoint'].calls)
+        self.assertIn('Profile (slowest first):', self.output.getvalue())
+        path, = glob.glob(os.path.join(self.dir, 'parse_statistics_*.txt'))
+        with open(path) as f:
+            self.assertIn('column text:', f.read())
+
+    def test_queries(self):
+        self.run_parser(CreatingParser(), self.write_csv('text\nfirst\nsecond\n'), profile='True')
+        parser = self.run_parser(CreatingParser(), self.write_csv('text\nfirst\nsecond\n'), profile='True')
+        self.assertGreaterEqual(parser.profiler.stages['row()'].queries, 2)
+        # Measuring is removed from connection after parsing
+        self.assertNotIn('commit', vars(connections['default']))
+
+    def test_disabled(self):
+        parser = self.run_parser(HandlerParser(), self.path)
+        self.assertIsNone(parser.profiler)
+        self.assertIs(type(parser.row_plan[0][1]), columns.StringColumn)
+
+    def test_workers(self):
+        parser = self.run_parser(HandlerParser(), self.path, profile='True', workers=2, chunk_size=1)
+        self.assertEqual(parser.profiler.stages['column number'].calls, 3)
+
+
+class ThreadedParser(BaseParser):
+    text = columns.StringColumn()
+    number = columns.IntegerColumn()
+
+    def __init__(self, *args, **kwargs):
+        super(ThreadedParser, self).__init__(*args, **kwargs)
+        self.threads = set()
+
+    def number_handler(self, value):
+        if value == 0:
+            raise ZeroDivisionError('Broken handler')
+        self.threads.add(threading.current_thread().name)
+        return value
+
+    def row(self, values):
+        # Later rows are handled faster, so they are finished out of order
+        time.sleep(0.01 / values['number'])
+        if values['number'] % 3 == 0:
+            raise ValueError('Broken row')
+
+
+class ThreadedSinkParser(SinkParser):
+    text = columns.StringColumn(required=False)
+
+
+class HandlerThreadsTest(ParserTestCase):
+    def setUp(self):
+        super(HandlerThreadsTest, self).setUp()
+        self.path = self.write_csv('text,number\n' + ''.join('row,{}\n'.format(i) for i in range(1, 11)))
+
+    def test_ordered_results(self):
+        parser = self.run_parser(ThreadedParser(), self.path, handler_threads=3, savestats='True')
+        self.assertEqual((parser.parsed_successfully, parser.parsed_unsuccessfully), (7, 3))
+        self.assertEqual(self.read_failed_rows()[1:], [
+            [str(index), 'Error during parsing row {}: Broken row'.format(index), 'row', str(index + 1)]
+            for index in (2, 5, 8)
+        ])
+        self.assertNotIn(threading.current_thread().name, parser.threads)
+
+    def test_connections_closed(self):
+        closed = []
+        close_all = connections.close_all
+
+        def record_close_all():
+            closed.append(threading.current_thread().name)
+            close_all()
+        self.addCleanup(setattr, connections, 'close_all', close_all)
+        connections.close_all = record_close_all
+        parser = self.run_parser(ThreadedParser(), self.path, handler_threads=3)
+        # Every thread closes its own connections once, connection of parser is kept
+        self.assertEqual(len(closed), 3)
+        self.assertEqual(len(set(closed)), 3)
+        self.assertTrue(parser.threads <= set(closed))
+        self.assertNotIn(threading.current_thread().name, closed)
+
+    def test_failfast(self):
+        path = self.write_csv('text,number\nrow,1\nrow,2\nrow,x\nrow,4\n')
+        parser = ThreadedParser()
+        with self.assertRaisesMessage(CommandError, 'Errors in cell 1'):
+            self.run_parser(parser, path, handler_threads=2, failfast='True', chunk_size=10)
+        # Rows before failed one are handled
+        self.assertEqual(parser.parsed_successfully, 2)
+
+    def test_handler_error(self):
+        path = self.write_csv('text,number\nrow,1\nrow,0\n')
+        with self.assertRaisesMessage(ZeroDivisionError, 'Broken handler'):
+            self.run_parser(ThreadedParser(), path, handler_threads=2)
+
+    def test_sink(self):
+        path = self.write_csv('text\nfirst\nsecond\nnull\nthird\n')
+        parser = self.run_parser(ThreadedSinkParser(), path, handler_threads=2, chunk_size=2)
+        self.assertEqual((parser.parsed_successfully, parser.parsed_unsuccessfully), (3, 1))
+        self.assertEqual(sorted(BasicModel.objects.values_list('text', flat=True)), ['first', 'second', 'third'])
+
+    def test_dryrun(self):
+        with self.assertRaisesMessage(CommandError, 'can\'t be rolled back'):
+            self.run_parser(ThreadedParser(), self.path, handler_threads=2, dryrun='True')
+
+
+class SinkTest(ParserTestCase):
+    def test_bulk_insert(self):
+        path = self.write_csv('text\nfirst\ninstance\nthird\n')
+        with CaptureQueriesContext(connection) as queries:
+            parser = self.run_parser(SinkParser(), path)
+        self.assertEqual(len([query for query in queries if 'INSERT' in query['sql']]), 2)
+        self.assertEqual(parser.parsed_successfully, 3)
+        self.assertEqual(list(BasicModel.objects.order_by('pk').values_list('text', flat=True)),
+                         ['first', 'instance', 'third'])
+
+    def test_no_savepoint_per_row(self):
+        path = self.write_csv('text\n' + 'row\n' * 20)
+        with CaptureQueriesContext(connection) as queries:
+            parser = self.run_parser(SinkParser(), path, chunk_size=20)
+        self.assertEqual(parser.parsed_successfully, 20)
+        # Only chunk and every flush of sink are wrapped into savepoints
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SAVEPOINT')]), 1 + 10)
+
+    def test_failed_rows(self):
+        path = self.write_csv('text\nfirst\nnull\nthird\n')
+        parser = self.run_parser(SinkParser(), path, chunk_size=10, savestats='True')
+        self.assertEqual(parser.parsed_successfully, 2)
+        self.assertEqual(parser.parsed_unsuccessfully, 1)
+        self.assertEqual([row[0] for row in self.read_failed_rows()], ['Row', '1'])
+        self.assertEqual(sorted(BasicModel.objects.values_list('text', flat=True)), ['first', 'third'])
+
+
+class UpsertParser(BaseParser):
+    code = columns.StringColumn()
+    text = columns.StringColumn(required=False)
+    sink_model = KeyedModel
+    upsert_keys = ('code',)
+    sink_batch_size = 3
+
+    def sink(self, values):
+        return {'code': values['code'], 'text': values.get('text')}
+
+
+class UpsertTest(ParserTestCase):
+    def setUp(self):
+        super(UpsertTest, self).setUp()
+        KeyedModel.objects.create(code='a', text='old')
+        KeyedModel.objects.create(code='b', text='same')
+        self.path = self.write_csv('code,text\na,new\nb,same\nc,created\nd,\n')
+
+    def test_upsert(self):
+        parser = self.run_parser(UpsertParser(), self.path)
+        self.assertEqual(parser.parsed_successfully, 4)
+        self.assertEqual(parser.upsert_counts, {'inserted': 2, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(dict(KeyedModel.objects.values_list('code', 'text')),
+                         {'a': 'new', 'b': 'same', 'c': 'created', 'd': None})
+        self.assertIn('Inserted 2 items, updated 1 items, 1 items unchanged.', self.output.getvalue())
+
+    def test_queries_per_chunk(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.run_parser(UpsertParser(), self.path)
+        # Rows are flushed in two batches, none of them is looked up by its own query
+        self.assertEqual(len([query for query in queries if 'ON CONFLICT' in query['sql']]), 2)
+        self.assertFalse([query for query in queries if 'WHERE "tests_keyedmodel"."code" =' in query['sql']])
+
+    def test_orm_fallback(self):
+        objs = [KeyedModel(code='a', text='new'), KeyedModel(code='b', text='same'), KeyedModel(code='c')]
+        counts = _merge_with_orm(connection, KeyedModel, [KeyedModel._meta.get_field('code')], objs)
+        self.assertEqual(counts, {'inserted': 1, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(dict(KeyedModel.objects.values_list('code', 'text')), {'a': 'new', 'b': 'same', 'c': None})
+
+    def test_staging_fallback(self):
+        def insert(connection, table, fields, rows):
+            raise TypeError('Value can\'t be copied')
+        self.addCleanup(operator.setitem, INSERTERS, connection.vendor, INSERTERS[connection.vendor])
+        INSERTERS[connection.vendor] = insert
+        objs = [KeyedModel(code='a', text='new'), KeyedModel(code='b', text='same'), KeyedModel(code='c')]
+        counts = _merge_with_staging(connection, KeyedModel, [KeyedModel._meta.get_field('code')], objs)
+        self.assertEqual(counts, {'inserted': 1, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(dict(KeyedModel.objects.values_list('code', 'text')), {'a': 'new', 'b': 'same', 'c': None})
+
+    def test_missing_fields_are_kept(self):
+        class CodeParser(UpsertParser):
+            code = columns.StringColumn()
+            text = columns.StringColumn(required=False)
+
+            def sink(self, values):
+                return {'code': values['code']}
+        parser = self.run_parser(CodeParser(), self.path)
+        self.assertEqual(parser.upsert_counts, {'inserted': 2, 'updated': 0, 'unchanged': 2})
+        self.assertEqual(dict(KeyedModel.objects.values_list('code', 'text')),
+                         {'a': 'old', 'b': 'same', 'c': None, 'd': None})
+
+    def test_upsert_fields(self):
+        class InstanceParser(UpsertParser):
+            code = columns.StringColumn()
+            text = columns.StringColumn(required=False)
+            upsert_fields = ('code',)
+
+            def sink(self, values):
+                return KeyedModel(code=values['code'], text='ignored')
+        self.run_parser(InstanceParser(), self.path)
+        self.assertEqual(dict(KeyedModel.objects.values_list('code', 'text')),
+                         {'a': 'old', 'b': 'same', 'c': 'ignored', 'd': 'ignored'})
+
+    def test_merge_given_fields(self):
+        key_fields = [KeyedModel._meta.get_field('code')]
+        for merge in (_merge_with_staging, _merge_with_orm):
+            KeyedModel.objects.filter(code='a').update(text='keep me')
+            counts = merge(connection, KeyedModel, key_fields, [KeyedModel(code='a'), KeyedModel(code=merge.__name__)],
+                           frozenset(['code']))
+            self.assertEqual(counts, {'inserted': 1, 'updated': 0, 'unchanged': 1})
+            self.assertEqual(KeyedModel.objects.get(code='a').text, 'keep me')
+
+    def test_wrong_upsert_fields(self):
+        class WrongParser(UpsertParser):
+            code = columns.StringColumn()
+            text = columns.StringColumn(required=False)
+            upsert_fields = ('missing',)
+        with self.assertRaisesMessage(CommandError, 'Wrong upsert_fields'):
+            self.run_parser(WrongParser(), self.path)
+
+    def test_keys_must_be_unique(self):
+        class NotUniqueParser(UpsertParser):
+            code = columns.StringColumn()
+            text = columns.StringColumn(required=False)
+            upsert_keys = ('text',)
+        with self.assertRaisesMessage(CommandError, 'Wrong upsert_keys: Fields text of KeyedModel are not unique together'):
+            self.run_parser(NotUniqueParser(), self.path)
+        self.assertEqual(KeyedModel.objects.count(), 2)
+
+
+class ParseApiTest(ParserTestCase):
+    def test_rows(self):
+        parser = FailingParser()
+        results = list(parser.parse([('first', 1), ('second', 3), ('', '')], header=False))
+        self.assertEqual(results, [
+            RowResult(0, 'Success', None, ('first', 1)),
+            RowResult(1, 'Failure', 'Error during parsing row 1: Broken row', ('second', 3)),
+        ])
+        self.assertEqual(parser.parsed_successfully, 1)
+
+    def test_invalid_cells(self):
+        parser = RecordingParser()
+        results = list(parser.parse([('first', 'one'), ('second', 2)], header=False))
+        self.assertEqual(results, [
+            RowResult(0, 'Success', "Errors in row 0: [{1: ['Not convertable to integer']}]", ('first', 'one')),
+            RowResult(1, 'Success', None, ('second', 2)),
+        ])
+        self.assertEqual(parser.rows, [{'text': 'first'}, {'text': 'second', 'number': 2}])
+
+    def test_generator_of_rows(self):
+        parser = RecordingParser()
+        results = list(parser.parse((row for row in [('text', 'number'), ('first', 1)])))
+        self.assertEqual([result.status for result in results], ['Success'])
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 1}])
+
+    def test_csv_file_object(self):
+        parser = RecordingParser()
+        results = list(parser.parse(StringIO('text,number\n first ,1\nsecond,2\n'), 'csv', chunk_size=10))
+        self.assertEqual([result.row_number for result in results], [0, 1])
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 1}, {'text': 'second', 'number': 2}])
+
+    def test_xlsx_file_object(self):
+        path = write_xlsx(os.path.join(self.dir, 'data.xlsx'), [
+            (1, ['<c t="inlineStr"><is><t>text</t></is></c>', '<c t="inlineStr"><is><t>number</t></is></c>']),
+            (2, ['<c t="inlineStr"><is><t>first</t></is></c>', '<c><v>1</v></c>']),
+        ])
+        parser = RecordingParser()
+        with open(path, 'rb') as f:
+            results = list(parser.parse(f, 'xlsx'))
+        self.assertEqual([result.status for result in results], ['Success'])
+        self.assertEqual(parser.rows, [{'text': 'first', 'number': 1}])
+
+    def test_sink_results(self):
+        results = list(SinkParser().parse([('first',), ('null',), ('third',)], header=False, chunk_size=10))
+        self.assertEqual(sorted((result.row_number, result.status) for result in results),
+                         [(0, 'Success'), (1, 'Failure'), (2, 'Success')])
+
+    def test_workers(self):
+        rows = [('row', number) for number in range(1, 7)]
+        results = list(FailingParser().parse(rows, header=False, workers=2, chunk_size=2))
+        self.assertEqual([result.status for result in results],
+                         ['Success', 'Success', 'Failure', 'Success', 'Success', 'Failure'])
+
+    def test_nothing_is_written(self):
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            list(FailingParser().parse([('first', 3)], header=False))
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(output.getvalue(), '')
+
+    def test_unknown_option(self):
+        with self.assertRaisesMessage(TypeError, 'Unknown options: chunksize'):
+            RecordingParser().parse([], chunksize=10)
+
+    def test_unknown_format(self):
+        with self.assertRaisesMessage(CommandError, 'Wrong file format'):
+            list(RecordingParser().parse(StringIO(''), 'txt'))
+
+
+class WorkersTest(ParserTestCase):
+    def setUp(self):
+        super(WorkersTest, self).setUp()
+        self.path = self.write_csv('text,number\n' + ''.join('row,{}\n'.format(i) for i in range(1, 11)))
+
+    def test_counters_are_merged(self):
+        parser = self.run_parser(FailingParser(), self.path, workers=2, chunk_size=2, savestats='True')
+        self.assertEqual(parser.parsed_successfully, 7)
+        self.assertEqual(parser.parsed_unsuccessfully, 3)
+        self.assertEqual([row[3] for row in self.read_failed_rows()], ['number', '3', '6', '9'])
+
+    def test_unordered(self):
+        parser = self.run_parser(FailingParser(), self.path, workers=2, chunk_size=3, ordered='False', savestats='True')
+        self.assertEqual(parser.parsed_successfully, 7)
+        self.assertEqual(sorted(row[3] for row in self.read_failed_rows()[1:]), ['3', '6', '9'])
+
+
+@override_settings(CREDENTIALS=object())
+class GoogleSpreadsheetTest(ParserTestCase):
+    def setUp(self):
+        super(GoogleSpreadsheetTest, self).setUp()
+        self.worksheet = StubWorksheet([['text', 'number']] + [['row', str(i)] for i in range(5)], row_count=100)
+        spreadsheet = StubSpreadsheet(self.worksheet)
+        gspread = types.ModuleType('gspread')
+        gspread.authorize = lambda credentials: StubClient(spreadsheet)
+        self.gspread = sys.modules.get('gspread')
+        sys.modules['gspread'] = gspread
+
+    def tearDown(self):
+        if self.gspread is None:
+            del sys.modules['gspread']
+        else:
+            sys.modules['gspread'] = self.gspread
+        super(GoogleSpreadsheetTest, self).tearDown()
+
+    def test_paged_fetch(self):
+        parser = RecordingParser()
+        parser.gsheet_page_size = 4
+        self.run_parser(parser, 'Sheet', google_spreadsheet='True')
+        self.assertEqual(parser.rows, [{'text': 'row', 'number': i} for i in range(5)])
+        self.assertEqual(self.worksheet.requests, ['row_values', 'A2:B5', 'A6:B9'])
+
+    def test_error_coordinates(self):
+        self.worksheet.rows[3][1] = 'x'
+        with self.assertRaisesMessage(CommandError, 'Errors in cell (4, 2)'):
+            self.run_parser(RecordingParser(), 'Sheet', google_spreadsheet='True', failfast='True')
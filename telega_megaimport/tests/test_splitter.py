@@ -0,0 +1,90 @@
+import os
+import csv
+import random
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from django.test import SimpleTestCase
+
+from telega_megaimport.splitter import CSVSplitter
+
+
+class CSVSplitterTest(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def write_csv(self, rows, name='data.csv'):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            csv.writer(f).writerows(rows)
+        return path
+
+    def make_rows(self, count):
+        rnd = random.Random(0)
+        rows = [['text', 'number', 'comment']]
+        for number in range(count):
+            # Quoted values with newlines and commas look like ends of rows
+            comment = rnd.choice(['plain', 'with, comma', 'multi\nline,\nvalue', '"quoted"\n1,2,3', ''])
+            rows.append(['row {}'.format(number), str(number), comment])
+        return rows
+
+    def read_ranges(self, splitter, ranges):
+        return [row for start, end in ranges for row in splitter.rows(start, end)]
+
+    def test_ranges_cover_all_rows(self):
+        rows = self.make_rows(500)
+        path = self.write_csv(rows)
+        with CSVSplitter(path) as splitter:
+            for parts in (1, 2, 3, 7, 16, 100):
+                ranges = splitter.ranges(parts)
+                self.assertEqual(ranges[0][0], splitter.data_start)
+                self.assertEqual(ranges[-1][1], os.path.getsize(path))
+                self.assertTrue(all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:])))
+                self.assertEqual(self.read_ranges(splitter, ranges), rows[1:])
+
+    def test_ranges_are_roughly_equal(self):
+        path = self.write_csv(self.make_rows(2000))
+        with CSVSplitter(path) as splitter:
+            ranges = splitter.ranges(4)
+        sizes = [end - start for start, end in ranges]
+        self.assertEqual(len(sizes), 4)
+        self.assertLess(max(sizes) - min(sizes), max(sizes) / 10)
+
+    def test_more_parts_than_rows(self):
+        rows = self.make_rows(3)
+        path = self.write_csv(rows)
+        with CSVSplitter(path) as splitter:
+            ranges = splitter.ranges(50)
+            self.assertEqual(self.read_ranges(splitter, ranges), rows[1:])
+
+    def test_without_header(self):
+        rows = self.make_rows(50)[1:]
+        path = self.write_csv(rows)
+        with CSVSplitter(path, header=False) as splitter:
+            self.assertEqual(self.read_ranges(splitter, splitter.ranges(5)), rows)
+
+    def test_dialect(self):
+        rows = [['text', 'number']] + [['row\t{}'.format(number), str(number)] for number in range(30)]
+        path = os.path.join(self.dir, 'data.tsv')
+        with open(path, 'wb') as f:
+            csv.writer(f, delimiter='\t').writerows(rows)
+        with CSVSplitter(path, delimiter='\t') as splitter:
+            self.assertEqual(self.read_ranges(splitter, splitter.ranges(3)), rows[1:])
+
+    def test_blank_lines(self):
+        path = os.path.join(self.dir, 'blank.csv')
+        with open(path, 'wb') as f:
+            f.write('a,b\r\n' + ''.join('{},x\r\n\r\n'.format(number) for number in range(40)))
+        with CSVSplitter(path) as splitter:
+            rows = [row for row in self.read_ranges(splitter, splitter.ranges(6)) if row]
+        self.assertEqual(rows, [[str(number), 'x'] for number in range(40)])
+
+    def test_empty_file(self):
+        path = os.path.join(self.dir, 'empty.csv')
+        open(path, 'wb').close()
+        with CSVSplitter(path) as splitter:
+            self.assertEqual(splitter.ranges(4), [])
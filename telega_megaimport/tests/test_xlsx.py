@@ -0,0 +1,101 @@
+import os
+import shutil
+import zipfile
+import tempfile
+from datetime import datetime
+
+from django.test import TestCase
+from xlrd import xldate_as_datetime
+from xlrd.biffh import XLRDError, XL_CELL_EMPTY, XL_CELL_TEXT, XL_CELL_NUMBER, XL_CELL_DATE, XL_CELL_BOOLEAN
+
+from telega_megaimport.xlsx import XLSXBook
+
+WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+ xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<workbookPr date1904="{date1904}"/>
+<sheets><sheet name="Data" sheetId="1" r:id="rId1"/><sheet name="Other" sheetId="2" r:id="rId2"/></sheets>
+</workbook>"""
+
+RELATIONS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="worksheet" Target="/xl/worksheets/sheet2.xml"/>
+</Relationships>"""
+
+STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy"/></numFmts>
+<cellXfs count="3"><xf numFmtId="0"/><xf numFmtId="164"/><xf numFmtId="14"/></cellXfs>
+</styleSheet>"""
+
+SHARED_STRINGS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<si><t>text</t></si><si><t>number</t></si><si><r><t>fir</t></r><r><t>st</t></r></si>
+</sst>"""
+
+SHEET = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+{dimension}<sheetData>{rows}</sheetData>
+</worksheet>"""
+
+
+def write_xlsx(path, rows, dimension=True, date1904=False):
+    """
+    Write minimal .xlsx file; rows are lists of '<c>' elements
+    """
+    row_elements = ''.join(
+        '<row r="{}">{}</row>'.format(index, ''.join(cells)) for index, cells in rows
+    )
+    ncols = max(len(cells) for _, cells in rows)
+    nrows = max(index for index, _ in rows)
+    sheet_dimension = '<dimension ref="A1:{}{}"/>'.format(chr(64 + ncols), nrows) if dimension else ''
+    with zipfile.ZipFile(path, 'w') as f:
+        f.writestr('xl/workbook.xml', WORKBOOK.format(date1904=int(date1904)))
+        f.writestr('xl/_rels/workbook.xml.rels', RELATIONS)
+        f.writestr('xl/styles.xml', STYLES)
+        f.writestr('xl/sharedStrings.xml', SHARED_STRINGS)
+        f.writestr('xl/worksheets/sheet1.xml', SHEET.format(dimension=sheet_dimension, rows=row_elements))
+        f.writestr('xl/worksheets/sheet2.xml', SHEET.format(dimension='', rows='<row r="1"><c r="A1"><v>1</v></c></row>'))
+    return path
+
+
+SAMPLE_ROWS = [
+    (1, ['<c r="A1" t="s"><v>0</v></c>', '<c r="B1" t="s"><v>1</v></c>', '<c r="C1" t="inlineStr"><is><t>date</t></is></c>']),
+    (2, ['<c r="A2" t="s"><v>2</v></c>', '<c r="B2"><v>1.5</v></c>', '<c r="C2" s="1"><v>42826</v></c>']),
+    (4, ['<c r="B4" t="b"><v>1</v></c>', '<c r="C4" s="2"><v>42827</v></c>']),
+]
+
+
+class XLSXBookTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = write_xlsx(os.path.join(self.dir, 'data.xlsx'), SAMPLE_ROWS)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_sheets(self):
+        book = XLSXBook(self.path)
+        self.assertEqual(book.sheet_names(), ['Data', 'Other'])
+        self.assertEqual(book.sheet_by_name('Other').path, 'xl/worksheets/sheet2.xml')
+        self.assertRaises(XLRDError, book.sheet_by_name, 'Missing')
+
+    def test_rows(self):
+        sheet = XLSXBook(self.path).sheet_by_index(0)
+        self.assertEqual((sheet.nrows, sheet.ncols), (4, 3))
+        rows = [[(cell.ctype, cell.value) for cell in row] for row in sheet.get_rows()]
+        self.assertEqual(rows, [
+            [(XL_CELL_TEXT, 'text'), (XL_CELL_TEXT, 'number'), (XL_CELL_TEXT, 'date')],
+            [(XL_CELL_TEXT, 'first'), (XL_CELL_NUMBER, 1.5), (XL_CELL_DATE, 42826.0)],
+            [(XL_CELL_EMPTY, '')] * 3,
+            [(XL_CELL_EMPTY, ''), (XL_CELL_BOOLEAN, 1), (XL_CELL_DATE, 42827.0)],
+        ])
+        self.assertEqual(xldate_as_datetime(rows[1][2][1], 0), datetime(2017, 4, 1))
+
+    def test_missing_dimension(self):
+        write_xlsx(self.path, SAMPLE_ROWS, dimension=False, date1904=True)
+        book = XLSXBook(self.path)
+        sheet = book.sheet_by_index(0)
+        self.assertEqual(book.datemode, 1)
+        self.assertEqual((sheet.nrows, sheet.ncols), (4, 3))
@@ -2,6 +2,8 @@ import csv
 import cStringIO
 import codecs
 
+from collections import OrderedDict
+
 
 class UnicodeWriter:
     """
@@ -15,9 +17,16 @@ class UnicodeWriter:
         self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
         self.stream = f
         self.encoder = codecs.getincrementalencoder(encoding)()
+        self.is_utf8 = codecs.lookup(encoding).name == 'utf-8'
+        self.direct_writer = csv.writer(f, dialect=dialect, **kwds)
 
     def writerow(self, row):
-        self.writer.writerow([s.encode("utf-8") for s in row])
+        row = [s.encode("utf-8") if isinstance(s, unicode) else s for s in row]
+        if self.is_utf8:
+            # No need to re-encode UTF-8 output
+            self.direct_writer.writerow(row)
+            return
+        self.writer.writerow(row)
         # Fetch UTF-8 output from the queue ...
         data = self.queue.getvalue()
         data = data.decode("utf-8")
@@ -30,4 +39,54 @@ class UnicodeWriter:
 
     def writerows(self, rows):
         for row in rows:
-            self.writerow(row)
\ No newline at end of file
+            self.writerow(row)
+
+
+def cellname(rowx, colx):
+    """
+    Name of spreadsheet cell, e.g. (2, 27) -> 'AB3'; the same as
+    xlrd.cellname, so xlrd isn't imported for other formats
+    """
+    name = ''
+    colx += 1
+    while colx:
+        colx, remainder = divmod(colx - 1, 26)
+        name = chr(65 + remainder) + name
+    return '{}{}'.format(name, rowx + 1)
+
+
+class SheetRow(tuple):
+    """
+    Raw values of spreadsheet row; xlrd types of its
+    cells are kept in `types`.
+    """
+
+    def __new__(cls, values, types):
+        row = super(SheetRow, cls).__new__(cls, values)
+        row.types = types
+        return row
+
+    def __reduce__(self):
+        return SheetRow, (tuple(self), self.types)
+
+
+class LRUCache(object):
+    """
+    Dict-like cache, which keeps only `size`
+    most recently used items.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+
+    def __getitem__(self, key):
+        value = self.items.pop(key)
+        self.items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
@@ -0,0 +1,237 @@
+import zipfile
+import posixpath
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+from collections import OrderedDict
+
+from django.utils import six
+from xlrd.biffh import (
+    XLRDError, XL_CELL_EMPTY, XL_CELL_TEXT, XL_CELL_NUMBER, XL_CELL_DATE, XL_CELL_BOOLEAN, XL_CELL_ERROR,
+    error_text_from_code
+)
+from xlrd.formatting import is_date_format_string, std_format_code_types, FDT
+from xlrd.sheet import Cell
+
+error_code_from_text = dict((text, code) for code, text in error_text_from_code.items())
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _text(element):
+    # Plain or rich text of shared string / inline string, without phonetic runs
+    parts = []
+    for child in element:
+        name = _local_name(child.tag)
+        if name == 't':
+            parts.append(child.text or u'')
+        elif name == 'r':
+            parts.extend(t.text or u'' for t in child if _local_name(t.tag) == 't')
+    return u''.join(six.text_type(part) for part in parts)
+
+
+def _cell_index(ref):
+    # 'AB12' -> (11, 27)
+    colx = 0
+    for position, char in enumerate(ref):
+        if char.isdigit():
+            return int(ref[position:]) - 1, colx - 1
+        colx = colx * 26 + ord(char.upper()) - 64
+    return None, colx - 1
+
+
+class XLSXBook(object):
+    """
+    Streaming reader of .xlsx files. Mimics part of xlrd Book API:
+    only selected sheet is read, row by row, so memory doesn't
+    depend on sheet size.
+    """
+    # Required by xlrd.formatting.is_date_format_string
+    verbosity = 0
+    logfile = None
+
+    def __init__(self, filename):
+        self.zip_file = zipfile.ZipFile(filename)
+        self.datemode = 0
+        self._sheets = OrderedDict()
+        self._shared_strings = None
+        self._date_styles = None
+        self._load_workbook()
+
+    def sheet_names(self):
+        return list(self._sheets)
+
+    def sheet_by_index(self, sheetx):
+        name = self.sheet_names()[sheetx]
+        return XLSXSheet(self, name, self._sheets[name])
+
+    def sheet_by_name(self, sheet_name):
+        try:
+            path = self._sheets[sheet_name]
+        except KeyError:
+            raise XLRDError('No sheet named <{!r}>'.format(sheet_name))
+        return XLSXSheet(self, sheet_name, path)
+
+    @property
+    def shared_strings(self):
+        if self._shared_strings is None:
+            self._shared_strings = []
+            if 'xl/sharedStrings.xml' in self.zip_file.namelist():
+                for _, element in ElementTree.iterparse(self.zip_file.open('xl/sharedStrings.xml')):
+                    if _local_name(element.tag) == 'si':
+                        self._shared_strings.append(_text(element))
+                        element.clear()
+        return self._shared_strings
+
+    @property
+    def date_styles(self):
+        # Indexes of cell formats, which display numbers as dates
+        if self._date_styles is None:
+            self._date_styles = set()
+            if 'xl/styles.xml' in self.zip_file.namelist():
+                self._load_styles(ElementTree.fromstring(self.zip_file.read('xl/styles.xml')))
+        return self._date_styles
+
+    def _load_workbook(self):
+        targets = {}
+        for relation in ElementTree.fromstring(self.zip_file.read('xl/_rels/workbook.xml.rels')):
+            target = relation.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join('xl', target))
+            targets[relation.get('Id')] = target
+        for element in ElementTree.fromstring(self.zip_file.read('xl/workbook.xml')).iter():
+            name = _local_name(element.tag)
+            if name == 'workbookPr':
+                self.datemode = int(element.get('date1904', '0').lower() in ('1', 'true'))
+            elif name == 'sheet':
+                relation_id = next(value for key, value in element.attrib.items()
+                                   if key.startswith('{') and _local_name(key) == 'id')
+                self._sheets[element.get('name')] = targets[relation_id]
+
+    def _load_styles(self, styles):
+        formats = {}
+        for element in styles.iter():
+            name = _local_name(element.tag)
+            if name == 'numFmt':
+                formats[int(element.get('numFmtId'))] = element.get('formatCode')
+            elif name == 'cellXfs':
+                for index, xf in enumerate(element):
+                    format_id = int(xf.get('numFmtId', 0))
+                    if format_id in formats:
+                        is_date = is_date_format_string(self, formats[format_id])
+                    else:
+                        is_date = std_format_code_types.get(format_id) == FDT
+                    if is_date:
+                        self._date_styles.add(index)
+
+
+class XLSXSheet(object):
+    """
+    Sheet of XLSXBook; rows are read lazily by get_rows()
+    and get_raw_rows().
+    """
+    def __init__(self, book, name, path):
+        self.book = book
+        self.name = name
+        self.path = path
+        self.nrows, self.ncols = self._read_dimension()
+
+    def get_rows(self):
+        "Returns a generator for iterating through each row."
+        for values, types in self.get_raw_rows():
+            yield [Cell(ctype, value) for value, ctype in zip(values, types)]
+
+    def get_raw_rows(self):
+        "Returns a generator of values and types of cells of each row."
+        next_rowx = 0
+        for rowx, values, types in self._iter_rows():
+            while next_rowx < rowx:
+                # Empty rows are not stored in file
+                yield self._pad([], [])
+                next_rowx += 1
+            yield self._pad(values, types)
+            next_rowx = rowx + 1
+
+    def _pad(self, values, types):
+        missing = self.ncols - len(values)
+        if missing > 0:
+            values.extend([u''] * missing)
+            types.extend([XL_CELL_EMPTY] * missing)
+        return values, types
+
+    def _read_dimension(self):
+        for _, element in ElementTree.iterparse(self.book.zip_file.open(self.path), events=('start',)):
+            name = _local_name(element.tag)
+            if name == 'dimension':
+                rowx, colx = _cell_index(element.get('ref').split(':')[-1])
+                return rowx + 1, colx + 1
+            elif name == 'sheetData':
+                break
+        # Dimension is optional, so rows have to be counted
+        nrows = ncols = 0
+        for rowx, values, _ in self._iter_rows():
+            nrows = rowx + 1
+            ncols = max(ncols, len(values))
+        return nrows, ncols
+
+    def _iter_rows(self):
+        sheet_data = None
+        rowx = -1
+        for event, element in ElementTree.iterparse(self.book.zip_file.open(self.path), events=('start', 'end')):
+            name = _local_name(element.tag)
+            if event == 'start':
+                if name == 'sheetData':
+                    sheet_data = element
+                continue
+            if name != 'row':
+                continue
+            rowx = int(element.get('r')) - 1 if element.get('r') else rowx + 1
+            values, types = self._parse_row(element)
+            yield rowx, values, types
+            # Parsed rows are dropped to keep memory flat
+            sheet_data.clear()
+
+    def _parse_row(self, row):
+        values = []
+        types = []
+        for element in row:
+            ref = element.get('r')
+            if ref:
+                _, colx = _cell_index(ref)
+                missing = colx - len(values)
+                if missing > 0:
+                    values.extend([u''] * missing)
+                    types.extend([XL_CELL_EMPTY] * missing)
+            ctype, value = self._parse_cell(element)
+            values.append(value)
+            types.append(ctype)
+        return values, types
+
+    def _parse_cell(self, element):
+        cell_type = element.get('t', 'n')
+        value = None
+        for child in element:
+            name = _local_name(child.tag)
+            if name == 'v':
+                value = child.text
+            elif name == 'is':
+                value = _text(child)
+        if value is None:
+            return XL_CELL_EMPTY, u''
+        if cell_type == 'n':
+            if int(element.get('s', 0)) in self.book.date_styles:
+                return XL_CELL_DATE, float(value)
+            return XL_CELL_NUMBER, float(value)
+        elif cell_type == 's':
+            return XL_CELL_TEXT, self.book.shared_strings[int(value)]
+        elif cell_type == 'b':
+            return XL_CELL_BOOLEAN, int(value)
+        elif cell_type == 'e':
+            return XL_CELL_ERROR, error_code_from_text.get(value, value)
+        return XL_CELL_TEXT, six.text_type(value)